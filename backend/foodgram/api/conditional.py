@@ -0,0 +1,44 @@
+import hashlib
+from datetime import datetime, timezone
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+
+from .ingredient_index import reference_data_version
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def set_validators(response, etag):
+    """ETag для ответа, зависящего от пользователя."""
+    response["ETag"] = etag
+    patch_vary_headers(response, ("Authorization",))
+    return response
+
+
+def not_modified(request, etag):
+    """Ответ 304, если у клиента актуальная версия, иначе None."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_validators(response, etag)
+    return response
+
+
+def reference_data_etag(request, *args, **kwargs):
+    return make_etag(reference_data_version(), request.get_full_path())
+
+
+def reference_data_last_modified(request, *args, **kwargs):
+    return datetime.fromtimestamp(
+        reference_data_version() // 10 ** 9, tz=timezone.utc
+    )
+
+
+# Теги и ингредиенты: версия справочников не требует запросов к базе.
+reference_data_condition = condition(
+    etag_func=reference_data_etag,
+    last_modified_func=reference_data_last_modified,
+)
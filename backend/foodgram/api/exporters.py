@@ -0,0 +1,83 @@
+import csv
+import json
+import os
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .pdf_download import pdf_download
+
+
+class Echo:
+    """Псевдобуфер: csv.writer отдает строку сразу в генератор."""
+
+    def write(self, value):
+        return value
+
+
+def attachment_name(extension):
+    return "{}.{}".format(os.path.splitext(settings.FILE_NAME)[0], extension)
+
+
+def streaming_attachment(content, content_type, extension):
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = 'attachment; filename="{}"'.format(
+        attachment_name(extension)
+    )
+    return response
+
+
+def txt_lines(ingredients):
+    yield "Список покупок:\n"
+    for ingredient in ingredients.iterator():
+        yield "{} - {} {}.\n".format(*ingredient)
+
+
+def csv_lines(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(("name", "amount", "measurement_unit"))
+    for ingredient in ingredients.iterator():
+        yield writer.writerow(ingredient)
+
+
+def json_lines(ingredients):
+    separator = "["
+    for name, amount, measurement_unit in ingredients.iterator():
+        yield separator + json.dumps(
+            {
+                "name": name,
+                "amount": amount,
+                "measurement_unit": measurement_unit,
+            },
+            ensure_ascii=False,
+        )
+        separator = ",\n"
+    yield "[]" if separator == "[" else "]"
+
+
+def txt_download(ingredients):
+    return streaming_attachment(
+        txt_lines(ingredients), "text/plain; charset=utf-8", "txt"
+    )
+
+
+def csv_download(ingredients):
+    return streaming_attachment(
+        csv_lines(ingredients), "text/csv; charset=utf-8", "csv"
+    )
+
+
+def json_download(ingredients):
+    return streaming_attachment(
+        json_lines(ingredients), "application/json", "json"
+    )
+
+
+# Форматы выгрузки списка покупок: ?format=<ключ>.
+EXPORTERS = {
+    "pdf": pdf_download,
+    "txt": txt_download,
+    "csv": csv_download,
+    "json": json_download,
+}
+DEFAULT_EXPORT_FORMAT = "pdf"
@@ -1,20 +1,42 @@
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 
 from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
+from .ingredient_index import reference_data_version
+from .pagination import RecipeCursorPagination
+
+_tag_bits = (None, {})
+
+
+def tag_bits():
+    """Слаг тэга -> бит маски, перечитывается при смене справочников."""
+    global _tag_bits
+    version, bits = _tag_bits
+    current = reference_data_version()
+    if version != current:
+        bits = dict(
+            Tag.objects.exclude(bit=None).values_list("slug", "bit")
+        )
+        _tag_bits = (current, bits)
+    return bits
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_bits()]
 
 
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name="tags__slug",
-        to_field_name="slug",
-        queryset=Tag.objects.all(),
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method="filter_tags"
     )
 
     is_favorited = filters.BooleanFilter(method="filter_is_favorited")
     is_in_shopping_cart = filters.BooleanFilter(
         method="filter_is_in_shopping_cart"
     )
+    search = filters.CharFilter(method="filter_search")
 
     class Meta:
         model = Recipe
@@ -23,6 +45,13 @@ class RecipeFilter(FilterSet):
             "author",
         )
 
+    def filter_tags(self, queryset, name, value):
+        # Тэг могли удалить после проверки вариантов: такой слаг пропускаем.
+        bits = tag_bits()
+        return queryset.with_any_tag(
+            bits[slug] for slug in value if slug in bits
+        )
+
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
@@ -35,6 +64,14 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shopping_recipe__user=user)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        # Курсор упорядочивает по дате и отбросил бы релевантность.
+        if RecipeCursorPagination.cursor_query_param in self.request.GET:
+            raise ValidationError(
+                {"search": "Поиск не поддерживает паджинацию по cursor."}
+            )
+        return search_recipes(queryset, value)
+
 
 class IngredientFilter(SearchFilter):
     search_param = "name"
@@ -0,0 +1,142 @@
+import os
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+
+def touch_stamp(path):
+    """Обновляет mtime файла-отметки, общей для всех воркеров."""
+    with open(path, "a"):
+        os.utime(path, None)
+    return os.stat(path).st_mtime_ns
+
+
+def read_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def touch_reference_stamp():
+    """Сообщает всем воркерам, что справочные данные изменились."""
+    return touch_stamp(settings.REFERENCE_DATA_STAMP)
+
+
+def read_reference_stamp():
+    return read_stamp(settings.REFERENCE_DATA_STAMP)
+
+
+def reference_data_version():
+    """Версия справочников: mtime отметки в наносекундах."""
+    return read_reference_stamp() or touch_reference_stamp()
+
+
+class IngredientIndex:
+    """Префиксный индекс ингредиентов в памяти процесса.
+
+    Хранит отсортированный список названий в нижнем регистре и ищет
+    по префиксу бинарным поиском. Индекс пересобирается, когда меняется
+    отметка REFERENCE_DATA_STAMP (её обновляют админка и import_csv).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = ([], [])
+        self._stamp = None
+        self._built = False
+
+    @staticmethod
+    def _entry(ingredient):
+        return (
+            (ingredient.name.lower(), ingredient.id),
+            {
+                "id": ingredient.id,
+                "name": ingredient.name,
+                "measurement_unit": ingredient.measurement_unit,
+            },
+        )
+
+    def build(self):
+        stamp = read_reference_stamp()
+        entries = sorted(
+            self._entry(ingredient)
+            for ingredient in Ingredient.objects.all().iterator()
+        )
+        with self._lock:
+            self._data = (
+                [key for key, _ in entries],
+                [item for _, item in entries],
+            )
+            self._stamp = stamp
+            self._built = True
+
+    def _ensure_fresh(self):
+        if not self._built or read_reference_stamp() != self._stamp:
+            self.build()
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        self._ensure_fresh()
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        prefix = prefix.strip().lower()
+        keys, items = self._data
+        start = bisect_left(keys, (prefix,))
+        result = []
+        for position in range(start, len(keys)):
+            if len(result) >= limit or not keys[position][0].startswith(
+                prefix
+            ):
+                break
+            result.append(items[position])
+        return result
+
+    def _replace(self, ingredient_id, entry=None):
+        """Копирует индекс без ingredient_id и, если нужно, с entry."""
+        keys, items = self._data
+        position = next(
+            (
+                position for position, item in enumerate(items)
+                if item["id"] == ingredient_id
+            ),
+            None,
+        )
+        keys, items = list(keys), list(items)
+        if position is not None:
+            del keys[position]
+            del items[position]
+        if entry is not None:
+            key, item = entry
+            position = bisect_left(keys, key)
+            keys.insert(position, key)
+            items.insert(position, item)
+        self._data = (keys, items)
+
+    def update(self, ingredient):
+        """Добавляет или обновляет ингредиент без полной пересборки."""
+        stamp = touch_reference_stamp()
+        if not self._built:
+            return
+        with self._lock:
+            self._replace(ingredient.id, self._entry(ingredient))
+            self._stamp = stamp
+
+    def remove(self, ingredient_id):
+        stamp = touch_reference_stamp()
+        if not self._built:
+            return
+        with self._lock:
+            self._replace(ingredient_id)
+            self._stamp = stamp
+
+    def invalidate(self):
+        """Заставляет все процессы пересобрать индекс при следующем поиске."""
+        touch_reference_stamp()
+        self._built = False
+
+
+ingredient_index = IngredientIndex()
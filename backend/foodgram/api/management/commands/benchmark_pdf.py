@@ -0,0 +1,49 @@
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from api.pdf_download import register_font, write_pdf
+
+
+class Command(BaseCommand):
+    help = "Замер времени и пиковой памяти генерации PDF списка покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sizes",
+            nargs="*",
+            type=int,
+            default=[10, 500, 5000],
+            help="Количество строк в списке покупок",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3,
+            help="Сколько раз повторить каждый замер",
+        )
+
+    def handle(self, *args, **options):
+        register_font()
+        for size in options["sizes"]:
+            ingredients = [
+                (f"Ингредиент {number}", number, "г")
+                for number in range(size)
+            ]
+            timings = []
+            peak = 0
+            pdf_size = 0
+            for _ in range(options["repeat"]):
+                buffer = BytesIO()
+                tracemalloc.start()
+                started = time.perf_counter()
+                write_pdf(ingredients, buffer)
+                timings.append(time.perf_counter() - started)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                pdf_size = buffer.tell()
+            self.stdout.write(
+                f"{size:>6} строк: {min(timings) * 1000:8.1f} мс, "
+                f"пик памяти {peak / 1024:8.1f} КиБ, "
+                f"PDF {pdf_size / 1024:8.1f} КиБ"
+            )
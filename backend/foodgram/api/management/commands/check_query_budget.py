@@ -0,0 +1,433 @@
+import json
+import os
+import tempfile
+import time
+from base64 import b64encode
+from io import BytesIO
+from itertools import combinations
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.pagination import CustomPageNumberPagination
+from recipes.models import (
+    Favourite,
+    Ingredient,
+    Recipe,
+    RecipeIngredients,
+    ShoppingCartList,
+    Tag,
+)
+from recipes.similarity import refresh_neighbours
+from users.models import Subscribe, User
+
+# Фильтры RecipeFilter; проверяются все их сочетания.
+RECIPE_FILTERS = {
+    "tags": "tags=t0&tags=t1",
+    "author": "author={author}",
+    "is_favorited": "is_favorited=1",
+    "is_in_shopping_cart": "is_in_shopping_cart=1",
+    "search": "search=суп",
+}
+INGREDIENTS_PER_RECIPE = 5
+# Замеры быстрее этого не сравниваются с базовыми: слишком шумные.
+MIN_COMPARED_MS = 5
+
+
+def png():
+    buffer = BytesIO()
+    Image.new("RGB", (32, 32), "orange").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверить, что число SQL-запросов эндпоинтов API не растет "
+        "с размером страницы, и замерить время ответа. Данные создаются "
+        "во временной тестовой базе SQLite (DEVELOPMENT_STATUS=True)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=[2, 10, 30],
+            help="Размеры страницы (и списков в запросах)",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3,
+            help="Сколько раз повторить каждый замер времени",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="JSON с прошлыми замерами: больше запросов - ошибка",
+        )
+        parser.add_argument(
+            "--max-slowdown", type=float, default=3.0,
+            help="Во сколько раз ответ может стать медленнее базового",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            help="Куда записать замеры в формате JSON",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError(
+                "Проверка рассчитана на SQLite: запустите "
+                "с DEVELOPMENT_STATUS=True."
+            )
+        sizes = sorted(set(options["sizes"]))
+        if sizes[0] <= 0:
+            raise CommandError("Размеры должны быть больше нуля.")
+        # Списки пользователей отдаются по одному на страницу: без этого
+        # размер страницы users.list и users.subscriptions не растет.
+        with tempfile.TemporaryDirectory() as media_root, mock.patch.object(
+            CustomPageNumberPagination, "max_page_size", sizes[-1]
+        ), override_settings(
+            MEDIA_ROOT=media_root,
+            IMAGE_WORKERS=0,
+            REFERENCE_DATA_STAMP=os.path.join(media_root, "reference.stamp"),
+            PANTRY_INDEX_STAMP=os.path.join(media_root, "pantry.stamp"),
+            CACHES={"default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "query-budget",
+            }},
+        ):
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True
+            )
+            try:
+                self.seed(max(sizes))
+                results, errors = self.measure(sizes, options["repeat"])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+        if options["baseline"]:
+            errors += self.compare(
+                results, options["baseline"], options["max_slowdown"]
+            )
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w", encoding="utf-8") as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        for error in errors:
+            self.stdout.write(self.style.ERROR(error))
+        if errors:
+            raise CommandError(f"Регрессий: {len(errors)}.")
+        self.stdout.write(self.style.SUCCESS("Регрессий нет."))
+
+    def seed(self, size):
+        image = png()
+        self.size = size
+        self.user = User.objects.create_user(
+            username="budget", email="budget@example.com", password="budget"
+        )
+        self.authors = [
+            User.objects.create_user(
+                username=f"author{number}",
+                email=f"author{number}@example.com",
+                password="budget",
+            )
+            for number in range(size)
+        ]
+        self.tags = [
+            Tag.objects.create(
+                name=f"Тэг {number}", slug=f"t{number}", color="#ff8800"
+            )
+            for number in range(3)
+        ]
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f"Ингредиент {number}", measurement_unit="г"
+            )
+            for number in range(max(size * 2, INGREDIENTS_PER_RECIPE * 2))
+        ]
+        self.recipes = []
+        for number in range(size * 2):
+            recipe = Recipe(
+                author=self.authors[number % size],
+                name=f"Суп {number}",
+                text="Суп из ингредиентов по порядку.",
+                cooking_time=10,
+            )
+            recipe.image.save(
+                f"budget{number}.png", ContentFile(image), save=False
+            )
+            recipe.save()
+            recipe.tags.set([self.tags[number % len(self.tags)]])
+            RecipeIngredients.objects.bulk_create(
+                RecipeIngredients(
+                    recipe=recipe,
+                    ingredient=self.ingredients[
+                        (number + offset) % len(self.ingredients)
+                    ],
+                    amount=offset + 1,
+                )
+                for offset in range(INGREDIENTS_PER_RECIPE)
+            )
+            self.recipes.append(recipe)
+        for author in self.authors:
+            Subscribe.objects.create(user=self.user, author=author)
+        for recipe in self.recipes[:size]:
+            Favourite.objects.create(user=self.user, recipe=recipe)
+            ShoppingCartList.objects.create(user=self.user, recipe=recipe)
+        refresh_neighbours(full=True)
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.authors[0])
+        self.image = "data:image/png;base64," + b64encode(image).decode()
+
+    def recipe_payload(self, size, start=0):
+        return {
+            "ingredients": [
+                {"id": ingredient.id, "amount": 1}
+                for ingredient in self.ingredients[start:start + size]
+            ],
+            "tags": [tag.id for tag in self.tags],
+            "image": self.image,
+            "name": "Проверка",
+            "text": "Проверка бюджета запросов.",
+            "cooking_time": 5,
+        }
+
+    def ids(self, size):
+        return [recipe.id for recipe in self.recipes[:size]]
+
+    def set_cart(self, size):
+        ShoppingCartList.objects.filter(user=self.user).delete()
+        for recipe in self.recipes[:size]:
+            ShoppingCartList.objects.create(user=self.user, recipe=recipe)
+
+    def remove_favorites(self, size):
+        Favourite.objects.filter(
+            user=self.user, recipe_id__in=self.ids(size)
+        ).delete()
+
+    def add_favorites(self, size):
+        for recipe_id in self.ids(size):
+            Favourite.objects.get_or_create(
+                user=self.user, recipe_id=recipe_id
+            )
+
+    def replace_ingredients(self, size):
+        """Ставит первому рецепту другие size ингредиентов: правка
+        в сценарии удалит и добавит по size строк состава."""
+        self.author_client.patch(
+            f"/api/recipes/{self.recipes[0].id}/",
+            self.recipe_payload(size, start=size),
+            format="json",
+        )
+
+    def restore_lists(self):
+        """Возвращает избранное и корзину к состоянию после seed."""
+        self.add_favorites(self.size)
+        self.set_cart(self.size)
+
+    def scenarios(self):
+        """(название, функция size -> (клиент, метод, url, данные))."""
+        recipe = self.recipes[0]
+        author = self.authors[0]
+        scenarios = [
+            ("recipes.list anonymous", lambda size: (
+                self.anonymous, "get", f"/api/recipes/?limit={size}", None
+            )),
+            ("recipes.list cursor", lambda size: (
+                self.client, "get", f"/api/recipes/?cursor=&limit={size}",
+                None,
+            )),
+            ("recipes.retrieve", lambda size: (
+                self.client, "get", f"/api/recipes/{recipe.id}/", None
+            )),
+            ("recipes.feed", lambda size: (
+                self.client, "get", f"/api/recipes/feed/?limit={size}", None
+            )),
+            ("recipes.similar", lambda size: (
+                self.client, "get", f"/api/recipes/{recipe.id}/similar/",
+                None,
+            )),
+            ("recipes.pantry", lambda size: (
+                self.client,
+                "get",
+                "/api/recipes/pantry/?max_missing=3&limit={}&{}".format(
+                    size,
+                    "&".join(
+                        f"ingredients={ingredient.id}"
+                        for ingredient in self.ingredients[:size]
+                    ),
+                ),
+                None,
+            )),
+            ("recipes.create", lambda size: (
+                self.author_client, "post", "/api/recipes/",
+                self.recipe_payload(size),
+            )),
+            ("recipes.partial_update", lambda size: (
+                self.replace_ingredients(size) or self.author_client,
+                "patch",
+                f"/api/recipes/{self.recipes[0].id}/",
+                self.recipe_payload(size),
+            )),
+            ("recipes.favorite", lambda size: (
+                self.remove_favorites(1) or self.client, "post",
+                f"/api/recipes/{recipe.id}/favorite/", None,
+            )),
+            ("recipes.delete_favorite", lambda size: (
+                self.add_favorites(1) or self.client, "delete",
+                f"/api/recipes/{recipe.id}/favorite/", None,
+            )),
+            ("recipes.bulk_favorite", lambda size: (
+                self.remove_favorites(size) or self.client, "post",
+                "/api/recipes/favorite/", {"recipes": self.ids(size)},
+            )),
+            ("recipes.bulk_delete_favorite", lambda size: (
+                self.add_favorites(size) or self.client, "delete",
+                "/api/recipes/favorite/", {"recipes": self.ids(size)},
+            )),
+            ("recipes.bulk_shopping_cart", lambda size: (
+                self.set_cart(0) or self.client, "post",
+                "/api/recipes/shopping_cart/", {"recipes": self.ids(size)},
+            )),
+            ("recipes.bulk_delete_shopping_cart", lambda size: (
+                self.set_cart(size) or self.client, "delete",
+                "/api/recipes/shopping_cart/", {"recipes": self.ids(size)},
+            )),
+            ("recipes.download_shopping_cart pdf", lambda size: (
+                self.set_cart(size) or self.client, "get",
+                "/api/recipes/download_shopping_cart/", None,
+            )),
+            ("recipes.download_shopping_cart txt", lambda size: (
+                self.set_cart(size) or self.client, "get",
+                "/api/recipes/download_shopping_cart/?format=txt", None,
+            )),
+            ("users.list", lambda size: (
+                self.client, "get", f"/api/users/?page_size={size}", None
+            )),
+            ("users.retrieve", lambda size: (
+                self.client, "get", f"/api/users/{author.id}/", None
+            )),
+            ("users.me", lambda size: (
+                self.client, "get", "/api/users/me/", None
+            )),
+            ("users.subscriptions", lambda size: (
+                self.client, "get",
+                f"/api/users/subscriptions/?page_size={size}"
+                f"&recipes_limit={size}",
+                None,
+            )),
+            ("tags.list", lambda size: (
+                self.anonymous, "get", "/api/tags/", None
+            )),
+            ("ingredients.list", lambda size: (
+                self.anonymous, "get", "/api/ingredients/", None
+            )),
+            ("ingredients.search", lambda size: (
+                self.anonymous, "get", "/api/ingredients/?name=ингр", None
+            )),
+        ]
+        for length in range(len(RECIPE_FILTERS) + 1):
+            for names in combinations(RECIPE_FILTERS, length):
+                query = "&".join(
+                    RECIPE_FILTERS[name].format(author=author.id)
+                    for name in names
+                )
+                scenarios.append((
+                    "recipes.list?" + "+".join(names),
+                    lambda size, query=query: (
+                        self.restore_lists() or self.client, "get",
+                        f"/api/recipes/?limit={size}&{query}", None,
+                    ),
+                ))
+        return scenarios
+
+    def run(self, request):
+        client, method, url, data = request
+        cache.clear()
+        # Журнал запросов ограничен: подготовка данных не должна его
+        # переполнить, иначе CaptureQueriesContext считает неверно.
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, len(queries), elapsed * 1000
+
+    def measure(self, sizes, repeat):
+        results = {}
+        errors = []
+        for name, build in self.scenarios():
+            results[name] = {}
+            for size in sizes:
+                # Прогрев: индексы и снимки в памяти процесса строятся
+                # при первом запросе.
+                self.run(build(size))
+                timings = []
+                for _ in range(max(repeat, 1)):
+                    status, queries, elapsed = self.run(build(size))
+                    timings.append(elapsed)
+                    if status >= 400:
+                        errors.append(f"{name} [{size}]: ответ {status}.")
+                results[name][str(size)] = {
+                    "queries": queries, "ms": round(min(timings), 2)
+                }
+            counts = [
+                measured["queries"] for measured in results[name].values()
+            ]
+            line = "{:55} запросов {:16} мс {}".format(
+                name,
+                "/".join(map(str, counts)),
+                "/".join(
+                    f"{measured['ms']:.1f}"
+                    for measured in results[name].values()
+                ),
+            )
+            if len(set(counts)) > 1:
+                errors.append(
+                    f"{name}: число запросов растет с размером "
+                    f"({', '.join(map(str, counts))})."
+                )
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        return results, errors
+
+    @staticmethod
+    def compare(results, path, max_slowdown):
+        with open(path, encoding="utf-8") as file:
+            baseline = json.load(file)
+        errors = []
+        for name, by_size in results.items():
+            for size, measured in by_size.items():
+                expected = baseline.get(name, {}).get(size)
+                if expected is None:
+                    continue
+                if measured["queries"] > expected["queries"]:
+                    errors.append(
+                        f"{name} [{size}]: запросов {measured['queries']}, "
+                        f"было {expected['queries']}."
+                    )
+                if (
+                    measured["ms"] > MIN_COMPARED_MS
+                    and measured["ms"] > expected["ms"] * max_slowdown
+                ):
+                    errors.append(
+                        f"{name} [{size}]: {measured['ms']:.1f} мс, "
+                        f"было {expected['ms']:.1f} мс."
+                    )
+        return errors
@@ -0,0 +1,252 @@
+"""Метрики Prometheus, общие для всех воркеров gunicorn.
+
+Каждый процесс пишет свои значения в файл METRICS_DIR/<pid>.db,
+отображенный в память, а /metrics складывает файлы всех процессов.
+Файлы завершившихся воркеров остаются, чтобы суммы счетчиков
+не уменьшались при перезапуске воркера.
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import defaultdict
+from glob import glob
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+USED = struct.Struct("Q")
+KEY_LENGTH = struct.Struct("i")
+VALUE = struct.Struct("d")
+INITIAL_SIZE = 64 * 1024
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PDF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Имя -> (тип, описание).
+METRICS = {
+    "foodgram_requests_total": (
+        "counter", "Запросы по обработчику, методу и статусу."
+    ),
+    "foodgram_request_errors_total": (
+        "counter", "Ответы с ошибкой сервера (5xx)."
+    ),
+    "foodgram_request_duration_seconds": (
+        "histogram", "Время обработки запроса."
+    ),
+    "foodgram_db_queries_total": ("counter", "SQL-запросы."),
+    "foodgram_db_duration_seconds_total": (
+        "counter", "Время выполнения SQL-запросов."
+    ),
+    "foodgram_pdf_generation_seconds": (
+        "histogram", "Время сборки PDF списка покупок."
+    ),
+}
+HISTOGRAM_SUFFIXES = ("_bucket", "_count", "_sum")
+LE = re.compile(r',?le="([^"]*)"')
+
+
+def aligned(position):
+    return (position + 7) // 8 * 8
+
+
+def read_entries(data):
+    """(ключ, позиция значения) записей файла значений."""
+    used = USED.unpack_from(data, 0)[0]
+    position = USED.size
+    while position < used:
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        key_start = position + KEY_LENGTH.size
+        value_position = aligned(key_start + length)
+        yield data[key_start:key_start + length].decode(), value_position
+        position = value_position + VALUE.size
+
+
+class ValuesFile:
+    """Значения метрик одного процесса в файле, отображенном в память.
+
+    Запись - длина ключа, ключ с выравниванием до 8 байт и значение
+    double. Новая запись видна читателям только после обновления
+    заголовка с занятым размером, а значения меняются на месте, так что
+    читать файл можно без блокировок.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < INITIAL_SIZE:
+            self._file.truncate(INITIAL_SIZE)
+            size = INITIAL_SIZE
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._positions = dict(read_entries(self._map))
+        self._used = USED.unpack_from(self._map, 0)[0] or USED.size
+
+    def _grow(self, size):
+        new_size = len(self._map)
+        while new_size < size:
+            new_size *= 2
+        self._map.close()
+        self._file.truncate(new_size)
+        self._map = mmap.mmap(self._file.fileno(), new_size)
+
+    def _append(self, key):
+        encoded = key.encode()
+        value_position = aligned(self._used + KEY_LENGTH.size + len(encoded))
+        end = value_position + VALUE.size
+        if end > len(self._map):
+            self._grow(end)
+        KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+        key_start = self._used + KEY_LENGTH.size
+        self._map[key_start:key_start + len(encoded)] = encoded
+        VALUE.pack_into(self._map, value_position, 0.0)
+        self._used = end
+        USED.pack_into(self._map, 0, end)
+        self._positions[key] = value_position
+        return value_position
+
+    def add(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        value = VALUE.unpack_from(self._map, position)[0]
+        VALUE.pack_into(self._map, position, value + amount)
+
+
+_lock = threading.Lock()
+_values = None
+
+
+def values_file():
+    """Файл значений текущего процесса, открывается заново после fork."""
+    global _values
+    pid = os.getpid()
+    if _values is None or _values[0] != pid:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _values = (pid, ValuesFile(
+            os.path.join(settings.METRICS_DIR, "{}.db".format(pid))
+        ))
+    return _values[1]
+
+
+def add(samples):
+    if not settings.METRICS_DIR:
+        return
+    with _lock:
+        values = values_file()
+        for key, amount in samples:
+            values.add(key, amount)
+
+
+def escape(value):
+    return (
+        str(value)
+        .replace("\\", r"\\")
+        .replace("\n", r"\n")
+        .replace('"', r"\"")
+    )
+
+
+def sample_key(name, labels=()):
+    if not labels:
+        return name
+    return "{}{{{}}}".format(name, ",".join(
+        '{}="{}"'.format(label, escape(value)) for label, value in labels
+    ))
+
+
+def histogram_samples(name, value, buckets, labels=()):
+    for bound in buckets:
+        yield sample_key(
+            name + "_bucket", labels + (("le", repr(float(bound))),)
+        ), int(value <= bound)
+    yield sample_key(name + "_bucket", labels + (("le", "+Inf"),)), 1
+    yield sample_key(name + "_sum", labels), value
+    yield sample_key(name + "_count", labels), 1
+
+
+def record_request(metrics, method, status):
+    """Учитывает запрос по замерам RequestMetrics."""
+    view = (("view", metrics.view or "none"),)
+    samples = [
+        (sample_key("foodgram_requests_total", view + (
+            ("method", method), ("status", str(status)),
+        )), 1),
+        (sample_key("foodgram_db_queries_total", view), metrics.queries),
+        (
+            sample_key("foodgram_db_duration_seconds_total", view),
+            metrics.db_time,
+        ),
+    ]
+    if status >= 500:
+        samples.append((sample_key(
+            "foodgram_request_errors_total", view + (("method", method),)
+        ), 1))
+    samples.extend(histogram_samples(
+        "foodgram_request_duration_seconds",
+        metrics.total_time,
+        REQUEST_BUCKETS,
+        view,
+    ))
+    add(samples)
+
+
+def record_pdf_generation(seconds):
+    add(histogram_samples(
+        "foodgram_pdf_generation_seconds", seconds, PDF_BUCKETS
+    ))
+
+
+def collect():
+    """Сумма значений по файлам всех процессов."""
+    totals = defaultdict(float)
+    for path in glob(os.path.join(settings.METRICS_DIR, "*.db")):
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < USED.size:
+            continue
+        for key, position in read_entries(data):
+            totals[key] += VALUE.unpack_from(data, position)[0]
+    return totals
+
+
+def family(key):
+    name = key.partition("{")[0]
+    if name in METRICS:
+        return name
+    for suffix in HISTOGRAM_SUFFIXES:
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def sample_order(key):
+    """Серии подряд, внутри гистограммы - бакеты по возрастанию le."""
+    name, _, labels = key.rstrip("}").partition("{")
+    le = LE.search(labels)
+    return LE.sub("", labels), name, float(le.group(1)) if le else 0.0
+
+
+def render(totals):
+    families = defaultdict(list)
+    for key in totals:
+        families[family(key)].append(key)
+    lines = []
+    for name in sorted(families):
+        metric_type, description = METRICS.get(name, ("untyped", ""))
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        lines.extend(
+            "{} {}".format(key, repr(totals[key]))
+            for key in sorted(families[name], key=sample_order)
+        )
+    return "\n".join(lines) + "\n"
+
+
+@require_GET
+def metrics_view(request):
+    return HttpResponse(
+        render(collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,154 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import record_request
+
+logger = logging.getLogger(__name__)
+
+
+def view_name(view_func, method):
+    """Имя обработчика вида RecipeViewSet.download_shopping_cart."""
+    view_class = getattr(view_func, "cls", None)
+    if view_class is None:
+        return "{}.{}".format(view_func.__module__, view_func.__name__)
+    actions = getattr(view_func, "actions", None) or {}
+    return "{}.{}".format(
+        view_class.__name__, actions.get(method.lower(), method.lower())
+    )
+
+
+@contextmanager
+def timed_serialization(request):
+    """Добавляет время блока к сериализации ответа в request.metrics."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = getattr(request, "metrics", None)
+        if metrics is not None:
+            metrics.serialize_time += time.perf_counter() - started
+
+
+class RequestMetrics:
+    """Замеры одного запроса: SQL, время базы, обработчика,
+    сериализации и рендера."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.view_started = None
+        self.view_time = 0.0
+        self.serialize_time = 0.0
+        self.render_started = None
+        self.render_time = 0.0
+        self.total_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def rendered(self, response):
+        self.render_time = time.perf_counter() - self.render_started
+
+    def repeated_statements(self):
+        return [
+            (sql, count)
+            for sql, count in self.statements.most_common(
+                settings.REQUEST_METRICS_TOP_STATEMENTS
+            )
+            if count > 1
+        ]
+
+    def server_timing(self):
+        return ", ".join((
+            'db;dur={:.1f};desc="{} SQL"'.format(
+                self.db_time * 1000, self.queries
+            ),
+            "view;dur={:.1f}".format(self.view_time * 1000),
+            "serialize;dur={:.1f}".format(self.serialize_time * 1000),
+            "render;dur={:.1f}".format(self.render_time * 1000),
+            "total;dur={:.1f}".format(self.total_time * 1000),
+        ))
+
+
+class RequestMetricsMiddleware:
+    """Считает SQL-запросы и время запроса, отдает их в Server-Timing.
+
+    serialize - сериализаторы и кэш представлений рецептов, замеренные
+    timed_serialization; они работают внутри обработчика, поэтому входят
+    и в view, а их SQL - и в db. render - только рендер ответа DRF
+    в байты.
+    Запросы дольше REQUEST_METRICS_SLOW_MS или с числом SQL больше
+    REQUEST_METRICS_MAX_QUERIES пишутся в лог с самыми частыми
+    повторяющимися запросами: повтор одного и того же SQL - признак N+1.
+    С METRICS_DIR замеры также идут в метрики Prometheus.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.metrics = RequestMetrics()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        metrics.total_time = time.perf_counter() - metrics.started
+        if metrics.view_started is not None and not metrics.view_time:
+            metrics.view_time = metrics.total_time - (
+                metrics.view_started - metrics.started
+            )
+        if settings.REQUEST_METRICS:
+            response["Server-Timing"] = metrics.server_timing()
+            self.log(request, response, metrics)
+        record_request(metrics, request.method, response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics.view = view_name(view_func, request.method)
+        request.metrics.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = request.metrics
+        metrics.render_started = time.perf_counter()
+        metrics.view_time = metrics.render_started - metrics.view_started
+        response.add_post_render_callback(metrics.rendered)
+        return response
+
+    @staticmethod
+    def log(request, response, metrics):
+        if (
+            metrics.total_time * 1000 < settings.REQUEST_METRICS_SLOW_MS
+            and metrics.queries <= settings.REQUEST_METRICS_MAX_QUERIES
+        ):
+            return
+        logger.warning(
+            "%s %s %s -> %s: %d SQL за %.1f мс, сериализация %.1f мс, "
+            "рендер %.1f мс, всего %.1f мс.%s",
+            metrics.view or "-",
+            request.method,
+            request.get_full_path(),
+            response.status_code,
+            metrics.queries,
+            metrics.db_time * 1000,
+            metrics.serialize_time * 1000,
+            metrics.render_time * 1000,
+            metrics.total_time * 1000,
+            "".join(
+                "\n  {} x {}".format(count, sql)
+                for sql, count in metrics.repeated_statements()
+            ),
+        )
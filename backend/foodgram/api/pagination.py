@@ -1,11 +1,23 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = "limit"
 
 
+class PantryPagination(PageLimitPagination):
+    page_size = 6
+    max_page_size = 100
+
+
 class CustomPageNumberPagination(PageNumberPagination):
     page_size = 1
     page_size_query_param = "page_size"
@@ -21,3 +33,122 @@ class CustomPageNumberPagination(PageNumberPagination):
                 "results": data,
             }
         )
+
+
+class RecipeCursorPagination(BasePagination):
+    """Курсорная паджинация ленты рецептов по ключу (pub_date, id).
+
+    Включается параметром ?cursor= (для первой страницы пустым).
+    Не выполняет COUNT и не использует OFFSET, поэтому время ответа
+    не зависит от глубины страницы.
+    """
+
+    cursor_query_param = "cursor"
+    date_field = "pub_date"
+    id_field = "id"
+    page_size_query_param = "limit"
+    page_size = 6
+    max_page_size = 100
+    invalid_cursor_message = "Неверный курсор."
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, pub_date, pk = b64decode(
+                encoded.encode("ascii")
+            ).decode("ascii").split("|")
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (BinasciiError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return reverse == "1", pub_date, pk
+
+    def encode_cursor(self, item, reverse):
+        raw = "{}|{}|{}".format(
+            int(reverse),
+            getattr(item, self.date_field).isoformat(),
+            getattr(item, self.id_field),
+        )
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            b64encode(raw.encode("ascii")).decode("ascii"),
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        date_field, id_field = self.date_field, self.id_field
+        if cursor is None:
+            reverse = False
+            queryset = queryset.order_by(f"-{date_field}", f"-{id_field}")
+        else:
+            reverse, pub_date, pk = cursor
+            lookup = "gt" if reverse else "lt"
+            queryset = queryset.filter(
+                Q(**{f"{date_field}__{lookup}": pub_date})
+                | Q(**{date_field: pub_date, f"{id_field}__{lookup}": pk})
+            )
+            if reverse:
+                queryset = queryset.order_by(date_field, id_field)
+            else:
+                queryset = queryset.order_by(
+                    f"-{date_field}", f"-{id_field}"
+                )
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Пустой cursor= - первая страница, но в курсорном режиме.
+            return replace_query_param(
+                self.base_url, self.cursor_query_param, ""
+            )
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """Курсорная паджинация ленты подписок по ключу (pub_date, recipe_id)
+    записей FeedEntry: чтение диапазона индекса одного подписчика."""
+
+    id_field = "recipe_id"
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeIngredients
+from .ingredient_index import read_stamp, touch_stamp
+
+
+def count_planes(bitsets):
+    """Побитовый счетчик: planes[i] - i-й разряд числа совпадений
+    каждого рецепта (сложение столбиком над всеми битами сразу)."""
+    planes = []
+    for carry in bitsets:
+        for position, plane in enumerate(planes):
+            planes[position], carry = plane ^ carry, plane & carry
+            if not carry:
+                break
+        if carry:
+            planes.append(carry)
+    return planes
+
+
+def equal_to(planes, value):
+    """Битсет рецептов, у которых счетчик planes равен value > 0."""
+    if value >> len(planes):
+        return 0
+    result = -1
+    for position, plane in enumerate(planes):
+        result &= plane if value >> position & 1 else ~plane
+    return result
+
+
+def bit_positions(bits):
+    digits = bin(bits)[:1:-1]
+    return [position for position, digit in enumerate(digits) if digit == "1"]
+
+
+def touch_pantry_stamp():
+    """Сообщает всем воркерам, что составы рецептов изменились."""
+    return touch_stamp(settings.PANTRY_INDEX_STAMP)
+
+
+class PantryIndex:
+    """Инвертированный индекс «ингредиент -> битсет рецептов» в памяти.
+
+    Рецептам выдаются плотные позиции битов (освободившиеся занимают
+    новые рецепты), так что длина битсетов растет с числом рецептов,
+    а не с их id. Поиск по имеющимся ингредиентам сводится
+    к побитовому сложению их битсетов и сравнению суммы с числом
+    ингредиентов рецепта, без запросов к RecipeIngredients.
+
+    Пока отметка PANTRY_INDEX_STAMP не менялась, поиск не ходит в базу.
+    Иначе индекс перечитывает рецепты, у которых updated_at попал
+    в окно PANTRY_INDEX_SYNC_WINDOW (его обновляет любое изменение
+    состава), а раз в PANTRY_INDEX_MAX_AGE секунд собирается заново,
+    чтобы учесть рецепты, удаленные в других процессах.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compositions = {}
+        self._positions = {}
+        self._recipe_ids = []
+        self._free = []
+        self._bitsets = {}
+        self._size_bits = {}
+        self._built_at = None
+        self._synced_at = None
+        self._stamp = None
+
+    @staticmethod
+    def _load(recipe_ids=None):
+        rows = RecipeIngredients.objects.all()
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        compositions = defaultdict(set)
+        for recipe_id, ingredient_id in rows.values_list(
+            "recipe_id", "ingredient_id"
+        ).iterator():
+            compositions[recipe_id].add(ingredient_id)
+        return compositions
+
+    def _add(self, recipe_id, ingredients):
+        self._compositions[recipe_id] = ingredients
+        if not ingredients:
+            return
+        if self._free:
+            position = self._free.pop()
+            self._recipe_ids[position] = recipe_id
+        else:
+            position = len(self._recipe_ids)
+            self._recipe_ids.append(recipe_id)
+        self._positions[recipe_id] = position
+        bit = 1 << position
+        for ingredient_id in ingredients:
+            self._bitsets[ingredient_id] = (
+                self._bitsets.get(ingredient_id, 0) | bit
+            )
+        size = len(ingredients)
+        self._size_bits[size] = self._size_bits.get(size, 0) | bit
+
+    def _remove(self, recipe_id):
+        ingredients = self._compositions.pop(recipe_id, None)
+        if not ingredients:
+            return
+        position = self._positions.pop(recipe_id)
+        self._recipe_ids[position] = None
+        self._free.append(position)
+        mask = ~(1 << position)
+        for ingredient_id in ingredients:
+            bits = self._bitsets[ingredient_id] & mask
+            if bits:
+                self._bitsets[ingredient_id] = bits
+            else:
+                del self._bitsets[ingredient_id]
+        size = len(ingredients)
+        bits = self._size_bits[size] & mask
+        if bits:
+            self._size_bits[size] = bits
+        else:
+            del self._size_bits[size]
+
+    def build(self, stamp=None):
+        synced_at = timezone.now()
+        compositions = self._load()
+        with self._lock:
+            self._compositions = {}
+            self._positions = {}
+            self._recipe_ids = []
+            self._free = []
+            self._bitsets = {}
+            self._size_bits = {}
+            for recipe_id in sorted(compositions):
+                self._add(recipe_id, frozenset(compositions[recipe_id]))
+            self._built_at = time.monotonic()
+            self._synced_at = synced_at
+            self._stamp = stamp
+
+    def sync(self):
+        # Отметка читается до запросов: изменение, закоммиченное
+        # во время синхронизации, сдвинет её еще раз.
+        stamp = read_stamp(settings.PANTRY_INDEX_STAMP)
+        if (
+            self._built_at is None
+            or time.monotonic() - self._built_at
+            > settings.PANTRY_INDEX_MAX_AGE
+        ):
+            self.build(stamp)
+            return
+        if stamp is not None and stamp == self._stamp:
+            return
+        synced_at = timezone.now()
+        changed = list(Recipe.objects.filter(
+            updated_at__gte=self._synced_at - timedelta(
+                seconds=settings.PANTRY_INDEX_SYNC_WINDOW
+            )
+        ).order_by().values_list("id", flat=True))
+        compositions = self._load(changed) if changed else {}
+        with self._lock:
+            for recipe_id in changed:
+                ingredients = frozenset(compositions.get(recipe_id, ()))
+                if self._compositions.get(recipe_id) != ingredients:
+                    self._remove(recipe_id)
+                    self._add(recipe_id, ingredients)
+            self._synced_at = synced_at
+            self._stamp = stamp
+
+    def remove(self, recipe_id):
+        with self._lock:
+            self._remove(recipe_id)
+
+    def search(self, ingredient_ids, max_missing):
+        """[(recipe_id, недостающих ингредиентов)] по возрастанию
+        недостающих, затем от новых рецептов к старым."""
+        self.sync()
+        result = []
+        with self._lock:
+            planes = count_planes(
+                self._bitsets[ingredient_id]
+                for ingredient_id in set(ingredient_ids)
+                if ingredient_id in self._bitsets
+            )
+            for missing in range(max_missing + 1):
+                found = 0
+                for size, bits in self._size_bits.items():
+                    if size > missing:
+                        found |= bits & equal_to(planes, size - missing)
+                result.extend(
+                    (recipe_id, missing)
+                    for recipe_id in sorted((
+                        self._recipe_ids[position]
+                        for position in bit_positions(found)
+                    ), reverse=True)
+                )
+        return result
+
+
+pantry_index = PantryIndex()
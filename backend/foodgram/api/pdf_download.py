@@ -1,31 +1,62 @@
-from io import BytesIO
+import os
+import time
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
 
+from django.conf import settings
 from django.http import FileResponse
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
+from .metrics import record_pdf_generation
 
-def pdf_download(ingredients):
-    file_list = []
-    [
-        file_list.append("{} - {} {}.".format(*ingredient))
-        for ingredient in ingredients
-    ]
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
+FONT_NAME = "Arial"
+FONT_SIZE = 12
+LEFT_MARGIN = 100
+TOP = 750
+BOTTOM_MARGIN = 50
+LINE_HEIGHT = 20
+# Файл держится в памяти до этого размера, дальше уходит на диск.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def register_font():
+    """Регистрирует шрифт один раз на процесс."""
     pdfmetrics.registerFont(
-        TTFont("Arial", "./recipes/fonts/arial.ttf")
+        TTFont(
+            FONT_NAME,
+            os.path.join(settings.BASE_DIR, "recipes", "fonts", "arial.ttf")
+        )
     )
-    p.setFont("Arial", 12)
-    p.drawString(100, 750, "Список покупок:")
-    y = 730
-    for ingredient in file_list:
-        p.drawString(100, y, ingredient)
-        y -= 20
+
+
+def write_pdf(ingredients, file):
+    """Пишет список покупок в file, переходя на новую страницу по мере
+    заполнения текущей."""
+    register_font()
+    p = canvas.Canvas(file, pagesize=letter)
+    p.setFont(FONT_NAME, FONT_SIZE)
+    p.drawString(LEFT_MARGIN, TOP, "Список покупок:")
+    y = TOP - LINE_HEIGHT
+    for ingredient in ingredients:
+        if y < BOTTOM_MARGIN:
+            p.showPage()
+            p.setFont(FONT_NAME, FONT_SIZE)
+            y = TOP
+        p.drawString(LEFT_MARGIN, y, "{} - {} {}.".format(*ingredient))
+        y -= LINE_HEIGHT
     p.showPage()
     p.save()
+
+
+def pdf_download(ingredients):
+    buffer = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    started = time.perf_counter()
+    write_pdf(ingredients, buffer)
+    record_pdf_generation(time.perf_counter() - started)
     buffer.seek(0)
     response = FileResponse(
         buffer, as_attachment=True, filename="purchases.pdf"
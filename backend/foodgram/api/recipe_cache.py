@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+
+from .middleware import timed_serialization
+from .serializers import RecipeReadSerializer, get_subscribed_author_ids
+
+# Увеличить при изменении формата RecipeReadSerializer.
+REPRESENTATION_VERSION = 1
+
+
+def representation_key(recipe, request):
+    """Ключ зависит от updated_at, поэтому изменение рецепта, его
+    ингредиентов, тегов или автора само делает старую запись ненужной."""
+    return "recipe:{}:{}:{}".format(
+        request.build_absolute_uri("/"),
+        recipe.id,
+        recipe.updated_at.timestamp(),
+    )
+
+
+def recipe_representations(recipes, context):
+    """Данные RecipeReadSerializer для recipes через кэш.
+
+    Из кэша берется часть, не зависящая от пользователя. Флаги
+    is_favorited и is_in_shopping_cart читаются из аннотаций
+    with_user_flags, is_subscribed - из подписок текущего запроса.
+    """
+    request = context["request"]
+    with timed_serialization(request):
+        keys = [representation_key(recipe, request) for recipe in recipes]
+        cached = cache.get_many(keys, version=REPRESENTATION_VERSION)
+        missing = [
+            recipe for recipe, key in zip(recipes, keys) if key not in cached
+        ]
+        if missing:
+            prefetch_related_objects(
+                missing, "tags", "recipe_ingredients__ingredient"
+            )
+            fresh = dict(zip(
+                (representation_key(recipe, request) for recipe in missing),
+                RecipeReadSerializer(missing, many=True, context=context).data,
+            ))
+            cache.set_many(
+                fresh,
+                timeout=settings.RECIPE_CACHE_TIMEOUT,
+                version=REPRESENTATION_VERSION,
+            )
+            cached.update(fresh)
+        subscribed = (
+            get_subscribed_author_ids(request)
+            if request.user.is_authenticated else set()
+        )
+        result = []
+        for recipe, key in zip(recipes, keys):
+            data = dict(cached[key])
+            if data["author"] is not None:
+                data["author"] = dict(
+                    data["author"],
+                    is_subscribed=recipe.author_id in subscribed,
+                )
+            data["is_favorited"] = recipe.is_favorited
+            data["is_in_shopping_cart"] = recipe.is_in_shopping_cart
+            result.append(data)
+    return result
@@ -0,0 +1,59 @@
+import gzip
+import re
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Ingredient, Tag
+from .ingredient_index import read_reference_stamp, reference_data_version
+from .serializers import IngredientSerializer, TagSerializer
+
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+
+
+class ReferenceSnapshot:
+    """Готовый JSON списка справочника в памяти процесса.
+
+    Хранит ответ уже сериализованным и сжатым gzip. Версия снимка -
+    отметка REFERENCE_DATA_STAMP: её обновляют сигналы админки
+    и import_csv, и каждый воркер перечитывает снимок при смене отметки.
+    """
+
+    def __init__(self, queryset, serializer_class):
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self._data = None
+
+    def build(self):
+        # Версию читаем до запроса, чтобы правка во время сборки
+        # привела к повторной сборке.
+        version = reference_data_version()
+        content = JSONRenderer().render(
+            self.serializer_class(self.queryset.all(), many=True).data
+        )
+        self._data = (version, content, gzip.compress(content))
+
+    def get(self):
+        data = self._data
+        if data is None or data[0] != read_reference_stamp():
+            self.build()
+            data = self._data
+        return data
+
+    def response(self, request):
+        _, content, compressed = self.get()
+        response = HttpResponse(content_type="application/json")
+        if ACCEPTS_GZIP.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+            response.content = compressed
+            response["Content-Encoding"] = "gzip"
+        else:
+            response.content = content
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+tags_snapshot = ReferenceSnapshot(Tag.objects.all(), TagSerializer)
+ingredients_snapshot = ReferenceSnapshot(
+    Ingredient.objects.all(), IngredientSerializer
+)
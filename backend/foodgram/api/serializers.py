@@ -1,22 +1,39 @@
+from collections.abc import Mapping
 from http import HTTPStatus
 
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 
 from recipes import constants
+from recipes.images import IMAGE_SIZES, variants_are_stale
+from recipes.search import schedule_index
+from recipes.signals import touch_recipes
 from users.models import Subscribe, User
 from recipes.models import (
     Favourite,
     Ingredient,
     Recipe,
     RecipeIngredients,
+    ShoppingCartIngredient,
     ShoppingCartList,
     Tag,
 )
 
 
+def get_subscribed_author_ids(request):
+    """Id авторов, на которых подписан пользователь, один раз на запрос."""
+    if not hasattr(request, "_subscribed_author_ids"):
+        request._subscribed_author_ids = set(
+            request.user.follower.values_list("author_id", flat=True)
+        )
+    return request._subscribed_author_ids
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Сериалайзер для создания и получение списка пользователей."""
 
@@ -36,13 +53,46 @@ class UserSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         request = self.context.get("request")
         return (request.user.is_authenticated
-                and request.user.follower.filter(author=obj).exists())
+                and obj.id in get_subscribed_author_ids(request))
+
+
+class RecipeImagesField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки рецепта в исходном формате
+    и WebP. Пока копии не готовы, отдает ссылку на оригинал."""
+
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get("request")
+
+        def absolute(url):
+            return request.build_absolute_uri(url) if request else url
+
+        if variants_are_stale(recipe):
+            original = absolute(recipe.image.url)
+            return {
+                size: {"original": original, "webp": original}
+                for size in IMAGE_SIZES
+            }
+        return {
+            size: {
+                image_format: absolute(default_storage.url(name))
+                for image_format, name in recipe.image_variants[size].items()
+            }
+            for size in IMAGE_SIZES
+        }
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Список рецептов без ингридиентов."""
 
     image = Base64ImageField(read_only=True)
+    images = RecipeImagesField()
 
     class Meta:
         model = Recipe
@@ -50,6 +100,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "image",
+            "images",
             "cooking_time"
         )
 
@@ -90,7 +141,7 @@ class SubscriptionSerializer(UserSerializer):
     """Сериалайзер для подписки."""
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source="recipes.count")
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -113,9 +164,12 @@ class SubscriptionSerializer(UserSerializer):
         limit = self.context.get("request").GET.get("recipes_limit")
         if limit:
             try:
-                recipe_obj = recipe_obj[:int(limit)]
+                limit = int(limit)
             except ValueError:
                 pass
+            else:
+                # Как в списке подписок: recipes_limit <= 0 - без рецептов.
+                recipe_obj = recipe_obj[:limit] if limit > 0 else []
         return RecipeSerializer(
             recipe_obj, many=True, context={"request": request}).data
 
@@ -150,7 +204,7 @@ class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = "__all__"
+        fields = ("id", "name", "color", "slug")
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -189,6 +243,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         many=True, source="recipe_ingredients"
     )
     image = Base64ImageField()
+    images = RecipeImagesField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
 
@@ -203,27 +258,57 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "images",
             "text",
             "cooking_time",
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
         request = self.context.get("request")
         return (request.user.is_authenticated
                 and obj.shopping_recipe.filter(user=request.user).exists())
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         request = self.context.get("request")
         return (request.user.is_authenticated
                 and obj.favourites_recipe.filter(user=request.user).exists())
 
 
+class InBulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Берет объекты из словаря bulk_objects корневого сериалайзера,
+    загруженного одним in_bulk, вместо запроса на каждый id."""
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        objects = getattr(self.root, "bulk_objects", {}).get(model)
+        if objects is None:
+            return super().to_internal_value(data)
+        pk = to_pk(model, data)
+        if pk is None:
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if pk not in objects:
+            self.fail("does_not_exist", pk_value=data)
+        return objects[pk]
+
+
+def to_pk(model, value):
+    """Значение первичного ключа model или None, если оно некорректно."""
+    if isinstance(value, bool):
+        return None
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        return None
+
+
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """Ингредиент и количество для создания рецепта."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = InBulkPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(
         min_value=constants.INGREDIENT_MIN_AMOUNT,
         max_value=constants.INGREDIENT_MAX_AMOUNT,
@@ -244,7 +329,7 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Создание, изменение и удаление рецепта."""
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = InBulkPrimaryKeyRelatedField(
         many=True, queryset=Tag.objects.all()
     )
     author = UserSerializer(read_only=True)
@@ -268,6 +353,28 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             "author",
         )
 
+    @staticmethod
+    def in_bulk(model, values):
+        pks = {to_pk(model, value) for value in values} - {None}
+        return model.objects.in_bulk(pks) if pks else {}
+
+    def to_internal_value(self, data):
+        self.bulk_objects = {}
+        if isinstance(data, Mapping):
+            tags = data.get("tags")
+            ingredients = data.get("ingredients")
+            if isinstance(tags, list):
+                self.bulk_objects[Tag] = self.in_bulk(Tag, tags)
+            if isinstance(ingredients, list):
+                self.bulk_objects[Ingredient] = self.in_bulk(
+                    Ingredient,
+                    (
+                        ingredient.get("id") for ingredient in ingredients
+                        if isinstance(ingredient, Mapping)
+                    ),
+                )
+        return super().to_internal_value(data)
+
     def validate(self, data):
         tags = data.get("tags")
         ingredients = data.get("ingredients")
@@ -315,6 +422,54 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ]
         RecipeIngredients.objects.bulk_create(ingredients_data)
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Меняет только отличающиеся строки состава рецепта.
+
+        Возвращает старые и новые суммы {ingredient_id: количество}.
+        """
+        new_amounts = {
+            ingredient["id"].id: ingredient["amount"]
+            for ingredient in ingredients
+        }
+        current = {}
+        old_amounts = {}
+        removed = []
+        for row in RecipeIngredients.objects.select_for_update().filter(
+            recipe=recipe
+        ):
+            old_amounts[row.ingredient_id] = (
+                old_amounts.get(row.ingredient_id, 0) + row.amount
+            )
+            if row.ingredient_id in current or (
+                row.ingredient_id not in new_amounts
+            ):
+                removed.append(row.pk)
+            else:
+                current[row.ingredient_id] = row
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            # Одним DELETE без сигналов по каждой строке: кэш, похожие
+            # рецепты и поисковый индекс один раз обновляет update().
+            RecipeIngredients.objects.filter(pk__in=removed)._raw_delete(
+                RecipeIngredients.objects.db
+            )
+        RecipeIngredients.objects.bulk_update(changed, ["amount"])
+        RecipeIngredients.objects.bulk_create(
+            RecipeIngredients(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in current
+        )
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop("tags")
         ingredients = validated_data.pop("ingredients")
@@ -325,18 +480,54 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         self.create_ingredients_and_tags(recipe, tags, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.ingredients.clear()
-        instance.tags.clear()
         ingredients = validated_data.pop("ingredients")
-        tags = validated_data.pop("tags")
-        self.create_ingredients_and_tags(instance, tags, ingredients)
+        instance.tags.set(validated_data.pop("tags"))
+        old_amounts, new_amounts = self.update_ingredients(
+            instance, ingredients
+        )
+        ShoppingCartIngredient.objects.recipe_changed(
+            instance.id, old_amounts, new_amounts
+        )
+        if old_amounts != new_amounts:
+            stale = {"neighbours_stale": True}
+            if old_amounts.keys() == new_amounts.keys():
+                stale = {}
+            touch_recipes(Recipe.objects.filter(pk=instance.pk), **stale)
+            schedule_index(instance.id)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], "tags", "recipe_ingredients__ingredient"
+        )
         return RecipeReadSerializer(instance, context=self.context).data
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления и удаления."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=constants.BULK_RECIPES_MAX,
+    )
+
+
+class PantrySerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=constants.PANTRY_INGREDIENTS_MAX,
+    )
+    max_missing = serializers.IntegerField(
+        min_value=0, max_value=constants.PANTRY_MISSING_MAX, default=2
+    )
+
+
 class ShoppingCartSerializer(FavouriteSerializer):
     """Сериализатор добавления рецепта в корзину"""
 
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, RecipeIngredients, Tag
+from .ingredient_index import ingredient_index, touch_reference_stamp
+from .pantry_index import pantry_index, touch_pantry_stamp
+
+
+# Отметка справочников обновляется только после коммита: иначе другой
+# воркер успеет пересобрать индекс по старым строкам с новой отметкой.
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: ingredient_index.update(instance))
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_from_ingredient_index(sender, instance, **kwargs):
+    ingredient_id = instance.id
+    transaction.on_commit(lambda: ingredient_index.remove(ingredient_id))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_reference_version(sender, **kwargs):
+    transaction.on_commit(touch_reference_stamp)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_pantry_index(sender, instance, **kwargs):
+    recipe_id = instance.id
+    transaction.on_commit(lambda: pantry_index.remove(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredients)
+@receiver(post_delete, sender=RecipeIngredients)
+def bump_pantry_version(sender, **kwargs):
+    transaction.on_commit(touch_pantry_stamp)
@@ -1,40 +1,80 @@
 from http import HTTPStatus
 
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from .pdf_download import pdf_download
+from .conditional import (
+    make_etag,
+    not_modified,
+    reference_data_condition,
+    set_validators,
+)
+from .exporters import DEFAULT_EXPORT_FORMAT, EXPORTERS
+from .ingredient_index import ingredient_index
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import PageLimitPagination, CustomPageNumberPagination
+from .middleware import timed_serialization
+from .negotiation import IgnoreFormatContentNegotiation
+from .pantry_index import pantry_index
+from .pagination import (
+    CustomPageNumberPagination,
+    FeedCursorPagination,
+    PageLimitPagination,
+    PantryPagination,
+    RecipeCursorPagination,
+)
 from .permissions import IsAuthorOrReadOnly
+from .recipe_cache import recipe_representations
+from .reference_data import ingredients_snapshot, tags_snapshot
 from .serializers import (
     FavouriteSerializer,
     IngredientSerializer,
+    PantrySerializer,
     RecipeCreateSerializer,
+    RecipeIdsSerializer,
     RecipeReadSerializer,
     ShoppingCartSerializer,
     TagSerializer,
     SubscribeSerializer,
     SubscriptionSerializer,
     UserSerializer,
+    get_subscribed_author_ids,
 )
 from recipes.models import (
     Favourite,
+    FeedEntry,
     Ingredient,
     Recipe,
-    RecipeIngredients,
+    ShoppingCartIngredient,
     ShoppingCartList,
     Tag,
 )
 from users.models import Subscribe, User
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class ReferenceSnapshotMixin:
+    """Отдает список без фильтров из снимка справочника в памяти."""
+
+    snapshot = None
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params and isinstance(
+            request.accepted_renderer, JSONRenderer
+        ):
+            return self.snapshot.response(request)
+        return super().list(request, *args, **kwargs)
+
+
+@method_decorator(reference_data_condition, name="list")
+@method_decorator(reference_data_condition, name="retrieve")
+class IngredientViewSet(ReferenceSnapshotMixin, ReadOnlyModelViewSet):
     """Вьюсет ингредиентов."""
 
     queryset = Ingredient.objects.all()
@@ -42,14 +82,24 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     filter_backends = (IngredientFilter,)
     search_fields = ("^name",)
+    snapshot = ingredients_snapshot
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(IngredientFilter.search_param)
+        if name:
+            return Response(ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+@method_decorator(reference_data_condition, name="list")
+@method_decorator(reference_data_condition, name="retrieve")
+class TagViewSet(ReferenceSnapshotMixin, ReadOnlyModelViewSet):
     """Вьюсет тэгов только для просмотра."""
 
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
     serializer_class = TagSerializer
+    snapshot = tags_snapshot
 
 
 class RecipeViewSet(ModelViewSet):
@@ -59,7 +109,7 @@ class RecipeViewSet(ModelViewSet):
         "author"
     ).prefetch_related(
         "tags",
-        "ingredients"
+        "recipe_ingredients__ingredient"
     )
     pagination_class = PageLimitPagination
     permission_classes = (IsAuthorOrReadOnly,)
@@ -73,11 +123,159 @@ class RecipeViewSet(ModelViewSet):
         "patch",
     )
 
+    @property
+    def paginator(self):
+        """Курсорный режим включается параметром ?cursor=."""
+        if (
+            not hasattr(self, "_paginator")
+            and RecipeCursorPagination.cursor_query_param
+            in self.request.query_params
+        ):
+            self._paginator = RecipeCursorPagination()
+        return super().paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset().with_user_flags(self.request.user)
+        if self.action in ("list", "retrieve", "feed", "similar", "pantry"):
+            # Теги и ингредиенты подгружает recipe_representations,
+            # и только для рецептов, которых нет в кэше.
+            return queryset.prefetch_related(None)
+        return queryset
+
     def get_serializer_class(self):
         if self.request.method == "GET":
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
+    def recipes_etag(self, recipes, *pagination):
+        """Версия страницы: рецепты, их флаги для пользователя и
+        паджинация. Считается до сериализации."""
+        subscribed = (
+            get_subscribed_author_ids(self.request)
+            if self.request.user.is_authenticated else set()
+        )
+        return make_etag(pagination, [
+            (
+                recipe.id,
+                recipe.updated_at,
+                recipe.is_favorited,
+                recipe.is_in_shopping_cart,
+                recipe.author_id in subscribed,
+            )
+            for recipe in recipes
+        ])
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            recipes = list(queryset)
+            etag = self.recipes_etag(recipes)
+        else:
+            recipes = page
+            etag = self.recipes_etag(
+                recipes,
+                self.paginator.get_next_link(),
+                self.paginator.get_previous_link(),
+                getattr(
+                    getattr(self.paginator.page, "paginator", None),
+                    "count",
+                    None,
+                ),
+            )
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        data = recipe_representations(
+            recipes, self.get_serializer_context()
+        )
+        if page is None:
+            return set_validators(Response(data), etag)
+        return set_validators(self.get_paginated_response(data), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        etag = self.recipes_etag([recipe])
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_validators(
+            Response(recipe_representations(
+                [recipe], self.get_serializer_context()
+            )[0]),
+            etag,
+        )
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь.
+
+        Страница читается из ленты FeedEntry подписчика, заполненной
+        при публикации рецептов, а не собирается по авторам.
+        """
+        paginator = FeedCursorPagination()
+        entries = paginator.paginate_queryset(
+            FeedEntry.objects.filter(user=request.user), request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in entries]
+        )
+        recipes = [
+            recipes[entry.recipe_id] for entry in entries
+            if entry.recipe_id in recipes
+        ]
+        etag = self.recipes_etag(
+            recipes, paginator.get_next_link(), paginator.get_previous_link()
+        )
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        data = recipe_representations(
+            recipes, self.get_serializer_context()
+        )
+        return set_validators(paginator.get_paginated_response(data), etag)
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        """Похожие по ингредиентам рецепты, рассчитанные заранее."""
+        recipe = self.get_object()
+        recipes = list(
+            self.get_queryset().filter(
+                similar_to__recipe=recipe
+            ).order_by("-similar_to__score", "pk")
+        )
+        return Response(recipe_representations(
+            recipes, self.get_serializer_context()
+        ))
+
+    @action(detail=False)
+    def pantry(self, request):
+        """Рецепты, которые можно приготовить из ?ingredients=, по
+        возрастанию числа недостающих ингредиентов (не больше
+        ?max_missing=)."""
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ranked = pantry_index.search(
+            serializer.validated_data["ingredients"],
+            serializer.validated_data["max_missing"],
+        )
+        paginator = PantryPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        missing = dict(page)
+        data = recipe_representations(
+            [
+                recipes[recipe_id] for recipe_id, _ in page
+                if recipe_id in recipes
+            ],
+            self.get_serializer_context(),
+        )
+        for item in data:
+            item["missing_ingredients"] = missing[item["id"]]
+        return paginator.get_paginated_response(data)
+
     @staticmethod
     def favorite_shopping_cart(serializers, request, pk):
         context = {"request": request}
@@ -86,9 +284,102 @@ class RecipeViewSet(ModelViewSet):
             data=data,
             context=context
         )
+        # Под той же блокировкой пользователя, что и массовые изменения.
+        with transaction.atomic():
+            serializers.Meta.model.objects.lock_user(request.user.id)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        with timed_serialization(request):
+            data = serializer.data
+        return Response(data, status=HTTPStatus.CREATED)
+
+    @staticmethod
+    def remove_favorite_shopping_cart(model, request, pk):
+        with transaction.atomic():
+            model.objects.lock_user(request.user.id)
+            user_recipe = model.objects.filter(
+                user=request.user, recipe_id=pk
+            )
+            if user_recipe.exists():
+                user_recipe.delete()
+                return Response(status=HTTPStatus.NO_CONTENT)
+        return Response(status=HTTPStatus.BAD_REQUEST)
+
+    @staticmethod
+    def bulk_favorite_shopping_cart(model, flag, request, add):
+        """Добавляет или удаляет список рецептов одной транзакцией.
+
+        Рецепты и их наличие у пользователя проверяются одним запросом,
+        в ответе - статус по каждому id.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=HTTPStatus.CREATED)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data["recipes"]))
+        with transaction.atomic():
+            # Повторный запрос того же пользователя ждет конца этого.
+            model.objects.lock_user(request.user.id)
+            present = dict(
+                Recipe.objects.filter(
+                    pk__in=recipe_ids
+                ).with_user_flags(request.user).values_list("pk", flag)
+            )
+            changed = [
+                recipe_id for recipe_id in recipe_ids
+                if recipe_id in present and present[recipe_id] != add
+            ]
+            if add:
+                model.objects.bulk_add(request.user.id, changed)
+            else:
+                model.objects.bulk_remove(request.user.id, changed)
+        statuses = (
+            ("added", "already_added") if add else ("removed", "not_added")
+        )
+        return Response({"results": [
+            {
+                "id": recipe_id,
+                "status": (
+                    "not_found" if recipe_id not in present
+                    else statuses[present[recipe_id] == add]
+                ),
+            }
+            for recipe_id in recipe_ids
+        ]})
+
+    @action(
+        detail=False,
+        methods=("post",),
+        url_path="favorite",
+        url_name="favorite-bulk",
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_favorite(self, request):
+        return self.bulk_favorite_shopping_cart(
+            Favourite, "is_favorited", request, add=True
+        )
+
+    @bulk_favorite.mapping.delete
+    def bulk_delete_favorite(self, request):
+        return self.bulk_favorite_shopping_cart(
+            Favourite, "is_favorited", request, add=False
+        )
+
+    @action(
+        detail=False,
+        methods=("post",),
+        url_path="shopping_cart",
+        url_name="shopping_cart-bulk",
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_shopping_cart(self, request):
+        return self.bulk_favorite_shopping_cart(
+            ShoppingCartList, "is_in_shopping_cart", request, add=True
+        )
+
+    @bulk_shopping_cart.mapping.delete
+    def bulk_delete_shopping_cart(self, request):
+        return self.bulk_favorite_shopping_cart(
+            ShoppingCartList, "is_in_shopping_cart", request, add=False
+        )
 
     @action(
         detail=True,
@@ -106,13 +397,7 @@ class RecipeViewSet(ModelViewSet):
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
-        favourite = Favourite.objects.filter(
-            user=request.user, recipe_id=pk
-        )
-        if favourite.exists():
-            favourite.delete()
-            return Response(status=HTTPStatus.NO_CONTENT)
-        return Response(status=HTTPStatus.BAD_REQUEST)
+        return self.remove_favorite_shopping_cart(Favourite, request, pk)
 
     @action(
         detail=True,
@@ -130,35 +415,37 @@ class RecipeViewSet(ModelViewSet):
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
-        shopping_cart = ShoppingCartList.objects.filter(
-            user=request.user, recipe_id=pk
+        return self.remove_favorite_shopping_cart(
+            ShoppingCartList, request, pk
         )
-        if shopping_cart.exists():
-            shopping_cart.delete()
-            return Response(status=HTTPStatus.NO_CONTENT)
-        return Response(status=HTTPStatus.BAD_REQUEST)
 
     @action(
         detail=False,
         methods=("get",),
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        content_negotiation_class=IgnoreFormatContentNegotiation,
     )
     def download_shopping_cart(self, request, **kwargs):
-        ingredients = (
-            RecipeIngredients.objects.filter(
-                recipe__shopping_recipe__user=request.user
-            )
-            .values("ingredient")
-            .annotate(total_amount=Sum("amount")).order_by(
-                "ingredient__name"
+        export_format = request.query_params.get(
+            "format", DEFAULT_EXPORT_FORMAT
+        )
+        if export_format not in EXPORTERS:
+            return Response(
+                {"errors": "Доступные форматы: {}.".format(
+                    ", ".join(EXPORTERS)
+                )},
+                status=HTTPStatus.BAD_REQUEST,
             )
+        ingredients = (
+            ShoppingCartIngredient.objects.filter(user=request.user)
+            .order_by("ingredient__name")
             .values_list(
                 "ingredient__name",
                 "total_amount",
                 "ingredient__measurement_unit"
             )
         )
-        return pdf_download(ingredients)
+        return EXPORTERS[export_format](ingredients)
 
 
 class UserViewSet(DjoserUserViewSet):
@@ -174,6 +461,43 @@ class UserViewSet(DjoserUserViewSet):
             return (IsAuthenticated(), )
         return super().get_permissions()
 
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        etag = make_etag(
+            user.id,
+            user.email,
+            user.username,
+            user.first_name,
+            user.last_name,
+            request.user.is_authenticated
+            and user.id in get_subscribed_author_ids(request),
+        )
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_validators(super().retrieve(request, *args, **kwargs), etag)
+
+    @staticmethod
+    def get_recipes_preview_queryset(request):
+        """Первые recipes_limit рецептов каждого автора одним запросом.
+
+        При recipes_limit <= 0 рецепты не загружаются вовсе.
+        """
+        recipes = Recipe.objects.all()
+        try:
+            limit = int(request.query_params.get("recipes_limit"))
+        except (TypeError, ValueError):
+            return recipes
+        if limit <= 0:
+            return recipes.none()
+        return recipes.filter(
+            pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef("author")
+                ).values("pk")[:limit]
+            )
+        )
+
     @action(
         detail=False,
         url_path="subscriptions",
@@ -182,7 +506,14 @@ class UserViewSet(DjoserUserViewSet):
     )
     def subscriptions(self, request):
         """Список авторов, на которых подписан пользователь."""
-        queryset = User.objects.filter(author__user=self.request.user)
+        queryset = User.objects.filter(
+            author__user=self.request.user
+        ).prefetch_related(
+            Prefetch(
+                "recipes",
+                queryset=self.get_recipes_preview_queryset(request)
+            )
+        )
         paginator = self.pagination_class()
         result_page = paginator.paginate_queryset(
             queryset, request, view=self
@@ -190,7 +521,9 @@ class UserViewSet(DjoserUserViewSet):
         serializer = SubscriptionSerializer(
             result_page, many=True, context={"request": request}
         )
-        return paginator.get_paginated_response(serializer.data)
+        with timed_serialization(request):
+            data = serializer.data
+        return paginator.get_paginated_response(data)
 
     @action(
         methods=("post",),
@@ -205,7 +538,9 @@ class UserViewSet(DjoserUserViewSet):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data, status=HTTPStatus.CREATED)
+        with timed_serialization(request):
+            data = serializer.data
+        return Response(data, status=HTTPStatus.CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id):
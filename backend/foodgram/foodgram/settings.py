@@ -134,4 +134,50 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "users.User"
 
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Сколько секунд хранить в кэше данные рецепта
+RECIPE_CACHE_TIMEOUT = int(os.getenv("RECIPE_CACHE_TIMEOUT", 60 * 60))
+
 FILE_NAME = "shopping_cart.txt"  # Имя файла-списка покупок
+
+# Сколько ингредиентов отдает автодополнение по ?name=
+INGREDIENT_SEARCH_LIMIT = int(os.getenv("INGREDIENT_SEARCH_LIMIT", 50))
+# Потоки для уменьшенных копий картинок рецептов, 0 - прямо в запросе
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+# Файл-отметка: его mtime сообщает воркерам об изменении справочников
+REFERENCE_DATA_STAMP = os.getenv(
+    "REFERENCE_DATA_STAMP", os.path.join(BASE_DIR, "data", "reference.stamp")
+)
+# Индекс «что приготовить»: отметка изменения составов рецептов,
+# раз в сколько секунд пересобирать целиком и за сколько последних
+# секунд перечитывать измененные рецепты
+PANTRY_INDEX_STAMP = os.getenv(
+    "PANTRY_INDEX_STAMP", os.path.join(BASE_DIR, "data", "pantry.stamp")
+)
+PANTRY_INDEX_MAX_AGE = int(os.getenv("PANTRY_INDEX_MAX_AGE", 10 * 60))
+PANTRY_INDEX_SYNC_WINDOW = int(os.getenv("PANTRY_INDEX_SYNC_WINDOW", 60))
+# Замеры SQL и времени каждого запроса с заголовком Server-Timing.
+# В лог попадают запросы дольше REQUEST_METRICS_SLOW_MS миллисекунд
+# или с числом SQL больше REQUEST_METRICS_MAX_QUERIES
+REQUEST_METRICS = os.getenv("REQUEST_METRICS", default="False") == "True"
+REQUEST_METRICS_SLOW_MS = int(os.getenv("REQUEST_METRICS_SLOW_MS", 500))
+REQUEST_METRICS_MAX_QUERIES = int(
+    os.getenv("REQUEST_METRICS_MAX_QUERIES", 30)
+)
+# Сколько повторяющихся SQL показывать в записи лога
+REQUEST_METRICS_TOP_STATEMENTS = 3
+
+# Каталог файлов метрик Prometheus для /metrics, общий для всех воркеров
+# gunicorn; пустой - метрики выключены
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+
+if REQUEST_METRICS or METRICS_DIR:
+    MIDDLEWARE.insert(0, "api.middleware.RequestMetricsMiddleware")
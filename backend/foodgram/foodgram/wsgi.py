@@ -10,7 +10,24 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodgram.settings")
 
 application = get_wsgi_application()
+
+from api.ingredient_index import ingredient_index  # noqa: E402
+from api.pantry_index import pantry_index  # noqa: E402
+from api.reference_data import (  # noqa: E402
+    ingredients_snapshot,
+    tags_snapshot,
+)
+
+try:
+    ingredient_index.build()
+    tags_snapshot.build()
+    ingredients_snapshot.build()
+    pantry_index.build()
+except DatabaseError:
+    # Индексы и снимки соберутся при первом запросе.
+    pass
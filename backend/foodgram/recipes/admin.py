@@ -57,10 +57,6 @@ class RecipeAdmin(admin.ModelAdmin):
         return ", ".join((str(ingredient) for ingredient
                           in obj.ingredients.all()))
 
-    @admin.display(description='Количество избранных рецептов')
-    def favorites_count(self, obj):
-        return obj.favourites_recipe.count()
-
     @admin.display(description="Изображение")
     def get_image(self, obj):
         return mark_safe(f"<img src={obj.image.url} width='80' height='60'>")
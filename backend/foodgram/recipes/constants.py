@@ -6,3 +6,10 @@ INGREDIENT_MIN_AMOUNT = 1
 INGREDIENT_MAX_AMOUNT = 10000
 RECIPE_NAME_AND_TAGS = 200
 TAG_COLOR = 7
+SEARCH_TERM_MAX_LENGTH = 64
+# Биты знаковой 64-битной маски тэгов рецепта.
+TAG_MASK_BITS = 63
+BULK_RECIPES_MAX = 100
+SIMILAR_RECIPES_COUNT = 10
+PANTRY_INGREDIENTS_MAX = 100
+PANTRY_MISSING_MAX = 10
@@ -0,0 +1,18 @@
+class CounterFieldsMixin:
+    """Не перезаписывает счетчики при сохранении объекта целиком.
+
+    Счетчики (и другие поля из counter_fields) меняются только запросами
+    в сигналах, а значение в памяти могло устареть с момента загрузки
+    объекта.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
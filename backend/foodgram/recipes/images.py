@@ -0,0 +1,108 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Название варианта и наибольшая сторона в пикселях.
+IMAGE_SIZES = {
+    "thumbnail": 100,
+    "card": 300,
+    "full": 1200,
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix="recipe-images",
+        )
+    return _executor
+
+
+def variants_are_stale(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get("source") != recipe.image.name
+    )
+
+
+def schedule_image_variants(recipe_id):
+    """Ставит генерацию вариантов изображения в пул воркеров.
+
+    При IMAGE_WORKERS = 0 варианты создаются сразу в текущем потоке.
+    """
+    if not settings.IMAGE_WORKERS:
+        build_image_variants(recipe_id)
+        return
+    get_executor().submit(run_in_worker, recipe_id)
+
+
+def run_in_worker(recipe_id):
+    try:
+        build_image_variants(recipe_id)
+    except Exception:
+        logger.exception(
+            "Не удалось обработать изображение рецепта %s", recipe_id
+        )
+    finally:
+        close_old_connections()
+
+
+def encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def build_image_variants(recipe_id):
+    from .models import Recipe
+
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not variants_are_stale(recipe):
+        return
+    source = recipe.image.name
+    with default_storage.open(source) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    has_alpha = original.mode in ("RGBA", "LA", "P")
+    original = original.convert("RGBA" if has_alpha else "RGB")
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = {"source": source}
+    for size_name, size in IMAGE_SIZES.items():
+        image = original.copy()
+        image.thumbnail((size, size))
+        prefix = f"recipes/variants/{recipe_id}/{stem}_{size_name}"
+        if has_alpha:
+            extension, content = ".png", encode(image, "PNG", optimize=True)
+        else:
+            extension, content = ".jpg", encode(
+                image, "JPEG", quality=JPEG_QUALITY, optimize=True
+            )
+        variants[size_name] = {
+            "original": default_storage.save(prefix + extension, content),
+            "webp": default_storage.save(
+                prefix + ".webp",
+                encode(image, "WEBP", quality=WEBP_QUALITY),
+            ),
+        }
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        image_variants=variants, updated_at=timezone.now()
+    )
+    old_variants = recipe.image_variants if updated else variants
+    for size_name in IMAGE_SIZES:
+        for name in old_variants.get(size_name, {}).values():
+            default_storage.delete(name)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_image_variants, variants_are_stale
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Создать уменьшенные копии картинок для рецептов без них"
+
+    def handle(self, *args, **options):
+        processed = 0
+        for recipe in Recipe.objects.only(
+            "id", "image", "image_variants"
+        ).iterator():
+            if variants_are_stale(recipe):
+                build_image_variants(recipe.id)
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано рецептов: {processed}."
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import refresh_neighbours
+
+
+class Command(BaseCommand):
+    help = "Пересчитать похожие рецепты по составу ингредиентов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Пересчитать все рецепты, а не только измененные",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = refresh_neighbours(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересчитано рецептов: {total} "
+            f"за {time.perf_counter() - started:.2f} с."
+        ))
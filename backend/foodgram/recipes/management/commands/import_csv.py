@@ -1,67 +1,143 @@
 import csv
+import json
 import os
+import time
+from itertools import islice
 
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.db import transaction
 
+from api.ingredient_index import ingredient_index
 from recipes.models import Ingredient, Tag
 
+# Модель, порядок колонок в файле и поле, по которому обновляются записи.
+SOURCES = {
+    "ingredients": (Ingredient, ("name", "measurement_unit"), None),
+    "tags": (Tag, ("name", "color", "slug"), "slug"),
+}
+
 
 class Command(BaseCommand):
-    help = "Import ingredients from CSV file"
+    help = "Import ingredients and tags from CSV or JSON files"
 
-    def handle(self, *args, **options):
-        csv_ingredients_file_path = os.path.join(
-            settings.BASE_DIR, "data", "ingredients.csv"
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ingredients",
+            default=os.path.join(settings.BASE_DIR, "data", "ingredients.csv"),
+            help="Путь к файлу ингредиентов (.csv или .json)",
         )
-        csv_tags_file_path = os.path.join(
-            settings.BASE_DIR, "data", "tags.csv"
+        parser.add_argument(
+            "--tags",
+            default=os.path.join(settings.BASE_DIR, "data", "tags.csv"),
+            help="Путь к файлу тегов (.csv или .json)",
         )
-        try:
-            with open(
-                    csv_ingredients_file_path, "r", encoding="utf-8"
-            ) as csv_file:
-                csv_reader = csv.reader(csv_file)
-                for name, measurement_unit in csv_reader:
-                    ingredient, created = Ingredient.objects.get_or_create(
-                        name=name, measurement_unit=measurement_unit
-                    )
-                    if created:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Ингредиент"
-                                f" {ingredient.name} добавлен в базу."
-                            )
-                        )
-                    else:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Ингредиент"
-                                f" {ingredient.name} уже есть в базе."
-                            )
-                        )
-        except FileNotFoundError:
-            raise CommandError(
-                "Файл ingredients не найден по указанному пути."
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк записывать одним запросом",
+        )
+        parser.add_argument(
+            "--update",
+            action="store_true",
+            help="Обновлять уже существующие записи вместо пропуска",
+        )
+
+    @staticmethod
+    def read_rows(path, fields):
+        """Построчно читает файл, отдавая кортежи в порядке fields."""
+        with open(path, "r", encoding="utf-8") as file:
+            if path.endswith(".json"):
+                for item in json.load(file):
+                    yield tuple(item[field] for field in fields)
+            else:
+                for row in csv.reader(file):
+                    if row:
+                        yield tuple(row)
+
+    @staticmethod
+    def save_batch(model, objects, fields, update_key, update):
+        """Возвращает количество обновленных записей.
+
+        Сравниваются и обновляются только колонки файла: служебные поля
+        вроде Tag.bit в файле не приходят и остаются как есть.
+        """
+        if not update or update_key is None:
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+            return 0
+        update_fields = [field for field in fields if field != update_key]
+        with transaction.atomic():
+            existing = model.objects.in_bulk(
+                [getattr(obj, update_key) for obj in objects],
+                field_name=update_key,
             )
+            changed = []
+            for obj in objects:
+                current = existing.get(getattr(obj, update_key))
+                if current is None:
+                    continue
+                obj.pk = current.pk
+                if any(
+                    getattr(obj, field) != getattr(current, field)
+                    for field in update_fields
+                ):
+                    changed.append(obj)
+            model.objects.bulk_create(
+                [obj for obj in objects if obj.pk is None],
+                ignore_conflicts=True,
+            )
+            model.objects.bulk_update(changed, update_fields)
+        return len(changed)
+
+    def load(self, source, path, batch_size, update):
+        model, fields, update_key = SOURCES[source]
+        before = model.objects.count()
+        rows_read = updated = 0
+        started = time.perf_counter()
         try:
-            with open(csv_tags_file_path, "r", encoding="utf-8") as ing_file:
-                reader = csv.reader(ing_file, delimiter=',')
-                for name, slug, color in reader:
-                    tag, created = Tag.objects.get_or_create(
-                        name=name,
-                        slug=slug,
-                        color=color,
-                    )
-                    if not created:
-                        self.stdout.write(self.style.WARNING(
-                            f"Тег {tag.name} уже есть в базе. Обновлено."))
-                    else:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Тег {tag.name} добавлен в базу.")
-                        )
+            rows = self.read_rows(path, fields)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                rows_read += len(batch)
+                updated += self.save_batch(
+                    model,
+                    [model(**dict(zip(fields, row))) for row in batch],
+                    fields,
+                    update_key,
+                    update,
+                )
         except FileNotFoundError:
             raise CommandError(
-                "Файл tags не найден по указанному пути."
+                f"Файл {source} не найден по указанному пути."
             )
+        except (KeyError, ValueError) as error:
+            raise CommandError(f"Некорректный файл {path}: {error}")
+        elapsed = time.perf_counter() - started
+        created = model.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f"{model._meta.verbose_name_plural}: прочитано {rows_read}, "
+            f"добавлено {created}, обновлено {updated}, "
+            f"пропущено {rows_read - created - updated} "
+            f"за {elapsed:.2f} с "
+            f"({rows_read / elapsed if elapsed else rows_read:.0f} строк/с)."
+        ))
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size должен быть больше нуля.")
+        for source in SOURCES:
+            self.load(
+                source,
+                options[source],
+                options["batch_size"],
+                options["update"],
+            )
+        try:
+            Tag.objects.assign_bits()
+        except ValidationError as error:
+            raise CommandError(error.messages[0])
+        ingredient_index.invalidate()
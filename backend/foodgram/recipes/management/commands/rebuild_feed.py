@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = "Пересобрать и сверить ленты подписок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="Только сверить таблицу, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify_only"]:
+            FeedEntry.objects.rebuild()
+            self.stdout.write("Ленты подписок пересобраны.")
+        expected = set(
+            (user_id, recipe_id) for user_id, recipe_id, _, _
+            in FeedEntry.objects.expected_entries().iterator()
+        )
+        actual = set(
+            FeedEntry.objects.values_list("user_id", "recipe_id").iterator()
+        )
+        for user_id, recipe_id in sorted(expected - actual):
+            self.stdout.write(self.style.WARNING(
+                f"Пользователь {user_id}: нет рецепта {recipe_id}."
+            ))
+        for user_id, recipe_id in sorted(actual - expected):
+            self.stdout.write(self.style.WARNING(
+                f"Пользователь {user_id}: лишний рецепт {recipe_id}."
+            ))
+        mismatches = len(expected ^ actual)
+        if mismatches:
+            raise CommandError(f"Расхождений: {mismatches}.")
+        self.stdout.write(self.style.SUCCESS("Расхождений нет."))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import index_recipe
+
+
+class Command(BaseCommand):
+    help = "Пересобрать поисковый индекс рецептов"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        for recipe_id in Recipe.objects.values_list(
+            "id", flat=True
+        ).iterator():
+            index_recipe(recipe_id)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Проиндексировано рецептов: {total} "
+            f"за {time.perf_counter() - started:.2f} с."
+        ))
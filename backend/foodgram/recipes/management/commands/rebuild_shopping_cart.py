@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = "Пересобрать и сверить суммы ингредиентов в корзинах"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="Только сверить таблицу, ничего не меняя",
+        )
+
+    @staticmethod
+    def find_mismatches():
+        expected = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingCartIngredient.objects.expected_totals().iterator()
+        }
+        actual = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingCartIngredient.objects.values_list(
+                "user_id", "ingredient_id", "total_amount"
+            ).iterator()
+        }
+        return {
+            key: (actual.get(key), expected.get(key))
+            for key in actual.keys() | expected.keys()
+            if actual.get(key) != expected.get(key)
+        }
+
+    def handle(self, *args, **options):
+        if not options["verify_only"]:
+            ShoppingCartIngredient.objects.rebuild()
+            self.stdout.write("Суммы в корзинах пересобраны.")
+        mismatches = self.find_mismatches()
+        for (user_id, ingredient_id), (actual, expected) in sorted(
+            mismatches.items()
+        ):
+            self.stdout.write(self.style.WARNING(
+                f"Пользователь {user_id}, ингредиент {ingredient_id}: "
+                f"в таблице {actual}, должно быть {expected}."
+            ))
+        if mismatches:
+            raise CommandError(f"Расхождений: {len(mismatches)}.")
+        self.stdout.write(self.style.SUCCESS("Расхождений нет."))
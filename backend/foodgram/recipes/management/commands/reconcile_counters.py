@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favourite, Recipe, Tag
+from users.models import Subscribe, User
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef("pk")}
+            ).order_by().values(field).annotate(
+                total=Count("pk")
+            ).values("total"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверить и исправить счетчики рецептов, избранного и подписчиков "
+        "и маски тэгов рецептов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать расхождения",
+        )
+
+    def handle(self, *args, **options):
+        counters = (
+            (User, "recipes_count", Recipe, "author"),
+            (User, "followers_count", Subscribe, "author"),
+            (Recipe, "favorites_count", Favourite, "recipe"),
+        )
+        for model, field, source, source_field in counters:
+            actual = count_subquery(source, source_field)
+            drifted = model.objects.annotate(
+                actual=actual
+            ).exclude(**{field: F("actual")})
+            total = drifted.count()
+            if total and not options["dry_run"]:
+                model.objects.filter(
+                    pk__in=drifted.values("pk")
+                ).update(**{field: actual})
+            style = self.style.WARNING if total else self.style.SUCCESS
+            self.stdout.write(style(
+                f"{model._meta.verbose_name_plural}.{field}: "
+                f"расхождений {total}."
+            ))
+        self.reconcile_tag_masks(options["dry_run"])
+
+    def reconcile_tag_masks(self, dry_run):
+        without_bit = Tag.objects.filter(bit=None)
+        total = without_bit.count()
+        if total and not dry_run:
+            without_bit.assign_bits()
+        if dry_run:
+            current = dict(Recipe.objects.values_list("pk", "tag_mask"))
+            drifted = sum(
+                current[recipe_id] != mask for recipe_id, mask
+                in Recipe.objects.expected_tag_masks().items()
+            )
+        else:
+            drifted = Recipe.objects.refresh_tag_masks()
+        for name, count in (
+            ("Тэги.bit", total),
+            ("Рецепты.tag_mask", drifted),
+        ):
+            style = self.style.WARNING if count else self.style.SUCCESS
+            self.stdout.write(style(f"{name}: расхождений {count}."))
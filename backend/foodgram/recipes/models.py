@@ -1,12 +1,16 @@
 from django.core.validators import (
     MinValueValidator, RegexValidator, MaxValueValidator
 )
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
-from django.db.models import UniqueConstraint
+from django.db.models import (
+    Case, Exists, F, OuterRef, Sum, UniqueConstraint, Value, When
+)
+from django.db.models.functions import Greatest
 
 from recipes import constants
-from users.models import User
+from recipes.counters import CounterFieldsMixin
+from users.models import Subscribe, User
 
 
 class Ingredient(models.Model):
@@ -36,6 +40,25 @@ class Ingredient(models.Model):
         return self.name
 
 
+TAG_LIMIT_MESSAGE = (
+    f"Тэгов не может быть больше {constants.TAG_MASK_BITS}."
+)
+
+
+class TagQuerySet(models.QuerySet):
+
+    def assign_bits(self):
+        """Выдает биты маски тэгам, созданным в обход save()."""
+        tags = list(self.filter(bit=None).order_by("pk"))
+        free_bits = Tag.free_bits()
+        if len(tags) > len(free_bits):
+            raise ValidationError(TAG_LIMIT_MESSAGE)
+        for tag, bit in zip(tags, free_bits):
+            tag.bit = bit
+        self.model.objects.bulk_update(tags, ["bit"])
+        return len(tags)
+
+
 class Tag(models.Model):
     """Модель тэга."""
 
@@ -55,6 +78,15 @@ class Tag(models.Model):
     slug = models.SlugField(
         "Слаг", unique=True, max_length=constants.RECIPE_NAME_AND_TAGS
     )
+    # Номер бита в Recipe.tag_mask. Битов TAG_MASK_BITS = 63, поэтому
+    # фильтровать по маске можно не больше 63 тэгов: clean() (админка)
+    # не дает создать лишний, а созданный кодом остается без бита
+    # и не попадает в варианты ?tags=.
+    bit = models.PositiveSmallIntegerField(
+        "Бит в маске тэгов", null=True, unique=True, editable=False
+    )
+
+    objects = TagQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Тэг"
@@ -63,8 +95,83 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def free_bits(cls):
+        used = set(
+            cls.objects.exclude(bit=None).values_list("bit", flat=True)
+        )
+        return [
+            bit for bit in range(constants.TAG_MASK_BITS) if bit not in used
+        ]
+
+    def clean(self):
+        if self.bit is None and not self.free_bits():
+            raise ValidationError(TAG_LIMIT_MESSAGE)
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            free_bits = self.free_bits()
+            if free_bits:
+                self.bit = free_bits[0]
+        super().save(*args, **kwargs)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Кверисет рецептов с флагами избранного и корзины."""
+
+    def with_user_flags(self, user):
+        """Аннотирует is_favorited и is_in_shopping_cart для user."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favourite.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCartList.objects.filter(
+                    user=user, recipe=OuterRef("pk")
+                )
+            ),
+        )
 
-class Recipe(models.Model):
+    def with_any_tag(self, bits):
+        """Рецепты, у которых есть хотя бы один тэг из bits.
+
+        Проверяется маска tag_mask самого рецепта, без join по тэгам,
+        поэтому дубликатов нет и DISTINCT не нужен.
+        """
+        mask = sum(1 << bit for bit in set(bits))
+        if not mask:
+            return self.none()
+        return self.alias(
+            tag_hits=F("tag_mask").bitand(mask)
+        ).filter(tag_hits__gt=0)
+
+    def expected_tag_masks(self):
+        """Маски тэгов, посчитанные заново по связям рецептов."""
+        masks = dict.fromkeys(self.values_list("pk", flat=True), 0)
+        for recipe_id, bit in Recipe.tags.through.objects.filter(
+            recipe_id__in=masks, tag__bit__isnull=False
+        ).values_list("recipe_id", "tag__bit"):
+            masks[recipe_id] |= 1 << bit
+        return masks
+
+    def refresh_tag_masks(self):
+        """Пересчитывает tag_mask рецептов, возвращает число исправленных."""
+        return sum(
+            Recipe.objects.filter(pk=recipe_id).exclude(
+                tag_mask=mask
+            ).update(tag_mask=mask)
+            for recipe_id, mask in self.expected_tag_masks().items()
+        )
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель рецепта."""
 
     author = models.ForeignKey(
@@ -98,6 +205,12 @@ class Recipe(models.Model):
     image = models.ImageField(
         "Изображение рецепта", upload_to="recipes/"
     )
+    image_variants = models.JSONField(
+        "Уменьшенные копии изображения",
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     name = models.CharField(
         "Название рецепта", max_length=constants.RECIPE_NAME_AND_TAGS
     )
@@ -108,9 +221,33 @@ class Recipe(models.Model):
         verbose_name="Дата публикации рецепта",
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        "Дата изменения рецепта", auto_now=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        "Количество избранных рецептов", default=0, editable=False
+    )
+    tag_mask = models.BigIntegerField(
+        "Маска тэгов", default=0, editable=False
+    )
+    neighbours_stale = models.BooleanField(
+        "Нужно пересчитать похожие рецепты", default=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ("favorites_count", "tag_mask", "neighbours_stale")
 
     class Meta:
         ordering = ("-pub_date",)
+        indexes = [
+            models.Index(
+                fields=("-pub_date", "-id"), name="recipe_pub_date_id_idx"
+            ),
+            models.Index(
+                fields=("updated_at",), name="recipe_updated_at_idx"
+            ),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
 
@@ -152,6 +289,69 @@ class RecipeIngredients(models.Model):
         )
 
 
+class UserRecipeManager(models.Manager):
+    """Массовое добавление и удаление рецептов пользователя.
+
+    Изменения одного пользователя идут по очереди под блокировкой его
+    строки (ее берут и одиночные добавление и удаление в API), а
+    счетчики меняются только для записей, которые действительно
+    вставлены или удалены. Вставка bulk_create и удаление _raw_delete
+    не вызывают сигналы, поэтому зависящие от записей данные обновляет
+    bulk_changed модели.
+    """
+
+    def lock_user(self, user_id):
+        """Блокирует пользователя до конца текущей транзакции."""
+        User.objects.select_for_update().only("pk").get(pk=user_id)
+
+    def _present(self, user_id, recipe_ids):
+        return set(
+            self.filter(
+                user_id=user_id, recipe_id__in=recipe_ids
+            ).values_list("recipe_id", flat=True)
+        )
+
+    def bulk_add(self, user_id, recipe_ids):
+        """Добавляет рецепты, которых у пользователя нет.
+
+        Возвращает id добавленных.
+        """
+        with transaction.atomic():
+            self.lock_user(user_id)
+            before = self._present(user_id, recipe_ids)
+            self.bulk_create(
+                [
+                    self.model(user_id=user_id, recipe_id=recipe_id)
+                    for recipe_id in recipe_ids
+                    if recipe_id not in before
+                ],
+                ignore_conflicts=True,
+            )
+            added = sorted(self._present(user_id, recipe_ids) - before)
+            self.model.bulk_changed(user_id, added, 1)
+        return added
+
+    def bulk_remove(self, user_id, recipe_ids):
+        """Удаляет рецепты, которые есть у пользователя.
+
+        Возвращает id удаленных.
+        """
+        with transaction.atomic():
+            self.lock_user(user_id)
+            rows = dict(
+                self.select_for_update().filter(
+                    user_id=user_id, recipe_id__in=recipe_ids
+                ).values_list("pk", "recipe_id")
+            )
+            if rows:
+                # Одним DELETE без загрузки записей: QuerySet.delete()
+                # вызвал бы обработчики сигналов на каждую запись.
+                self.filter(pk__in=rows)._raw_delete(self.db)
+            removed = sorted(rows.values())
+            self.model.bulk_changed(user_id, removed, -1)
+        return removed
+
+
 class UserRecipe(models.Model):
     """Абстрактный класс для покупок и избранного."""
     user = models.ForeignKey(
@@ -166,10 +366,17 @@ class UserRecipe(models.Model):
         verbose_name="Рецепт",
     )
 
+    objects = UserRecipeManager()
+
     class Meta:
         abstract = True
         unique_together = ("user", "recipe")
 
+    @classmethod
+    def bulk_changed(cls, user_id, recipe_ids, delta):
+        """Вызывается после массового добавления (delta = 1)
+        или удаления (delta = -1) рецептов recipe_ids."""
+
     def clean(self):
         if self.__class__.objects.filter(
                 user=self.user, recipe=self.recipe
@@ -196,6 +403,12 @@ class Favourite(UserRecipe):
         verbose_name = "Избранные рецепты"
         verbose_name_plural = "Избранные рецепты"
 
+    @classmethod
+    def bulk_changed(cls, user_id, recipe_ids, delta):
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            favorites_count=Greatest(F("favorites_count") + delta, 0)
+        )
+
 
 class ShoppingCartList(UserRecipe):
     """Наследник абстрактного класса для покупок."""
@@ -203,3 +416,334 @@ class ShoppingCartList(UserRecipe):
         default_related_name = "shopping_recipe"
         verbose_name = "Список для покупок"
         verbose_name_plural = "Списки для покупок"
+
+    @classmethod
+    def bulk_changed(cls, user_id, recipe_ids, delta):
+        if not recipe_ids:
+            return
+        change = (
+            ShoppingCartIngredient.objects.add_recipe if delta > 0
+            else ShoppingCartIngredient.objects.remove_recipe
+        )
+        change((user_id,), *recipe_ids)
+
+
+class RecipeSearchTerm(models.Model):
+    """Запись инвертированного индекса поиска рецептов."""
+
+    term = models.CharField(
+        "Основа слова", max_length=constants.SEARCH_TERM_MAX_LENGTH
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="search_terms",
+        verbose_name="Рецепт",
+    )
+    weight = models.PositiveIntegerField("Вес")
+
+    class Meta:
+        verbose_name = "Слово поискового индекса"
+        verbose_name_plural = "Поисковый индекс"
+        constraints = [
+            UniqueConstraint(
+                fields=["term", "recipe"],
+                name="unique_search_term_recipe"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.term} - {self.recipe_id}"
+
+
+class RecipeNeighbour(models.Model):
+    """Похожий рецепт из списка, рассчитанного командой
+    build_similar_recipes."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="neighbours",
+        verbose_name="Рецепт",
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="similar_to",
+        verbose_name="Похожий рецепт",
+    )
+    score = models.FloatField("Сходство")
+
+    class Meta:
+        verbose_name = "Похожий рецепт"
+        verbose_name_plural = "Похожие рецепты"
+        constraints = [
+            UniqueConstraint(
+                fields=["recipe", "similar"],
+                name="unique_recipe_neighbour"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=("recipe", "-score"),
+                name="recipe_neighbour_score_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} ~ {self.similar_id}: {self.score:.2f}"
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    """Инкрементальное обновление сумм ингредиентов в корзинах."""
+
+    def apply(self, user_ids, amounts):
+        """Прибавляет amounts {ingredient_id: количество} к корзинам
+        пользователей user_ids. Отрицательное количество вычитается."""
+        user_ids = list(user_ids)
+        amounts = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items() if amount
+        }
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids for ingredient_id in amounts
+            ],
+            ignore_conflicts=True,
+        )
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        rows.update(
+            total_amount=F("total_amount") + Case(
+                *(
+                    When(ingredient_id=ingredient_id, then=Value(amount))
+                    for ingredient_id, amount in amounts.items()
+                ),
+                default=Value(0),
+                output_field=models.IntegerField(),
+            )
+        )
+        rows.filter(total_amount__lte=0).delete()
+
+    @staticmethod
+    def recipe_amounts(*recipe_ids):
+        """Суммы ингредиентов рецептов {ingredient_id: количество}."""
+        return dict(
+            RecipeIngredients.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values("ingredient_id").annotate(
+                total=Sum("amount")
+            ).values_list("ingredient_id", "total")
+        )
+
+    def add_recipe(self, user_ids, *recipe_ids):
+        self.apply(user_ids, self.recipe_amounts(*recipe_ids))
+
+    def remove_recipe(self, user_ids, *recipe_ids):
+        self.apply(
+            user_ids,
+            {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in self.recipe_amounts(*recipe_ids).items()
+            },
+        )
+
+    def recipe_changed(self, recipe_id, old_amounts, new_amounts):
+        """Переносит в корзины изменение состава рецепта."""
+        delta = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        self.apply(
+            ShoppingCartList.objects.filter(
+                recipe_id=recipe_id
+            ).values_list("user_id", flat=True),
+            delta,
+        )
+
+    @staticmethod
+    def expected_totals():
+        """Суммы, посчитанные заново из корзин и рецептов."""
+        return RecipeIngredients.objects.filter(
+            recipe__shopping_recipe__isnull=False
+        ).values(
+            "recipe__shopping_recipe__user", "ingredient"
+        ).annotate(
+            total=Sum("amount")
+        ).values_list("recipe__shopping_recipe__user", "ingredient", "total")
+
+    def rebuild(self, batch_size=1000):
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total,
+                    )
+                    for user_id, ingredient_id, total
+                    in self.expected_totals().iterator()
+                ),
+                batch_size=batch_size,
+            )
+
+
+class ShoppingCartIngredient(models.Model):
+    """Сумма каждого ингредиента в корзине пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_ingredients",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_totals",
+        verbose_name="Ингредиент",
+    )
+    total_amount = models.IntegerField("Общее количество", default=0)
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = "Ингредиент в корзине"
+        verbose_name_plural = "Ингредиенты в корзинах"
+        constraints = [
+            UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_cart_ingredient"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.ingredient} {self.total_amount}"
+
+
+class FeedEntryManager(models.Manager):
+    """Заполнение ленты подписок при записи (fan-out on write)."""
+
+    batch_size = 1000
+
+    def add_recipe(self, recipe):
+        """Добавляет рецепт в ленты всех подписчиков автора."""
+        if recipe.author_id is None:
+            return
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    author_id=recipe.author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in Subscribe.objects.filter(
+                    author_id=recipe.author_id
+                ).values_list("user_id", flat=True).iterator()
+            ),
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def subscribe(self, user_id, author_id):
+        """Добавляет в ленту подписчика уже опубликованные рецепты."""
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, pub_date in Recipe.objects.filter(
+                    author_id=author_id
+                ).values_list("id", "pub_date").iterator()
+            ),
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def unsubscribe(self, user_id, author_id):
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+    @staticmethod
+    def expected_entries():
+        """Записи ленты, посчитанные заново из подписок и рецептов."""
+        return Subscribe.objects.filter(
+            author__recipes__isnull=False
+        ).values_list(
+            "user_id",
+            "author__recipes__id",
+            "author_id",
+            "author__recipes__pub_date",
+        )
+
+    def rebuild(self):
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        recipe_id=recipe_id,
+                        author_id=author_id,
+                        pub_date=pub_date,
+                    )
+                    for user_id, recipe_id, author_id, pub_date
+                    in self.expected_entries().iterator()
+                ),
+                batch_size=self.batch_size,
+            )
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика его автора."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Подписчик",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Рецепт",
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Автор",
+    )
+    pub_date = models.DateTimeField("Дата публикации рецепта")
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = "Запись ленты подписок"
+        verbose_name_plural = "Лента подписок"
+        constraints = [
+            UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_feed_entry"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=("user", "-pub_date", "-recipe"),
+                name="feed_user_pub_date_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.recipe}"
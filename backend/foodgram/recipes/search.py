@@ -0,0 +1,191 @@
+"""Полнотекстовый поиск рецептов по инвертированному индексу.
+
+Индекс хранится в таблице RecipeSearchTerm: основа слова, рецепт и вес.
+Основы получаются русским стеммером Snowball (порт на регулярных
+выражениях), так что «томаты», «томатами» и «томат» совпадают.
+"""
+import math
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+)
+
+TOKEN_RE = re.compile(r"[а-яёa-z0-9]+")
+STOP_WORDS = frozenset((
+    "в", "во", "и", "к", "с", "со", "у", "о", "об", "от", "до", "за",
+    "из", "на", "не", "но", "по", "для", "как", "что", "это", "или",
+    "а", "же", "то", "так", "при", "без",
+))
+# Сколько секунд хранить число рецептов для расчета IDF.
+RECIPES_TOTAL_TIMEOUT = 5 * 60
+# Вес слова в зависимости от поля рецепта.
+NAME_WEIGHT = 3
+INGREDIENT_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+PERFECTIVE_GERUND = re.compile(
+    r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$"
+)
+REFLEXIVE = re.compile(r"(с[яь])$")
+ADJECTIVE = re.compile(
+    r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|"
+    r"ую|юю|ая|яя|ою|ею)$"
+)
+PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+VERB = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|"
+    r"ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)|"
+    r"((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|"
+    r"ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+RV = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+DERIVATIONAL = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+DERIVATIONAL_ENDING = re.compile(r"ость?$")
+SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+
+
+def stem(word):
+    """Основа русского слова по алгоритму Snowball."""
+    word = word.replace("ё", "е")
+    match = RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+    stripped = PERFECTIVE_GERUND.sub("", rv, 1)
+    if stripped == rv:
+        rv = REFLEXIVE.sub("", rv, 1)
+        stripped = ADJECTIVE.sub("", rv, 1)
+        if stripped != rv:
+            rv = PARTICIPLE.sub("", stripped, 1)
+        else:
+            stripped = VERB.sub("", rv, 1)
+            rv = NOUN.sub("", rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+    rv = re.sub("и$", "", rv, 1)
+    if DERIVATIONAL.match(rv):
+        rv = DERIVATIONAL_ENDING.sub("", rv, 1)
+    stripped = re.sub("ь$", "", rv, 1)
+    if stripped == rv:
+        rv = SUPERLATIVE.sub("", rv, 1)
+        rv = re.sub("нн$", "н", rv, 1)
+    else:
+        rv = stripped
+    return prefix + rv
+
+
+def terms(text):
+    """Основы слов текста без стоп-слов."""
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOP_WORDS or len(token) < 2:
+            continue
+        yield stem(token)
+
+
+def index_recipe(recipe_id):
+    """Пересобирает записи индекса одного рецепта."""
+    from .models import Ingredient, Recipe, RecipeSearchTerm
+
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        "name", "text"
+    ).first()
+    if recipe is None:
+        return
+    weights = Counter()
+    for term in terms(recipe["name"]):
+        weights[term] += NAME_WEIGHT
+    for name in Ingredient.objects.filter(
+        recipes=recipe_id
+    ).values_list("name", flat=True):
+        for term in terms(name):
+            weights[term] += INGREDIENT_WEIGHT
+    for term in terms(recipe["text"]):
+        weights[term] += TEXT_WEIGHT
+    max_length = RecipeSearchTerm._meta.get_field("term").max_length
+    with transaction.atomic():
+        RecipeSearchTerm.objects.filter(recipe_id=recipe_id).delete()
+        RecipeSearchTerm.objects.bulk_create(
+            RecipeSearchTerm(
+                recipe_id=recipe_id, term=term[:max_length], weight=weight
+            )
+            for term, weight in weights.items()
+        )
+
+
+def index_recipes(recipe_ids):
+    for recipe_id in sorted(recipe_ids):
+        index_recipe(recipe_id)
+
+
+def schedule_index(recipe_id):
+    """Переиндексирует рецепт после коммита, один раз за транзакцию.
+
+    Сохранение рецепта и каждой строки его состава просят об индексации;
+    id копятся в наборе на соединении, который обрабатывает один
+    обработчик on_commit.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        index_recipe(recipe_id)
+        return
+    pending = getattr(connection, "search_index_pending", None)
+    # После коммита или отката очередь on_commit заменяется новым
+    # списком: набор прошлой транзакции больше не обработается.
+    if pending is None or pending[0] is not connection.run_on_commit:
+        recipe_ids = set()
+        transaction.on_commit(lambda: index_recipes(recipe_ids))
+        pending = (connection.run_on_commit, recipe_ids)
+        connection.search_index_pending = pending
+    pending[1].add(recipe_id)
+
+
+def search_recipes(queryset, query):
+    """Рецепты queryset, подходящие под query, по убыванию релевантности.
+
+    Релевантность - сумма весов совпавших основ, умноженных на IDF.
+    Кандидаты выбираются по индексу основ, поэтому время не зависит
+    от общего числа рецептов.
+    """
+    from .models import Recipe, RecipeSearchTerm
+
+    query_terms = set(terms(query))
+    document_frequency = dict(
+        RecipeSearchTerm.objects.filter(
+            term__in=query_terms
+        ).values("term").annotate(
+            total=Count("recipe")
+        ).values_list("term", "total")
+    )
+    if not document_frequency:
+        return queryset.none()
+    recipes_total = cache.get_or_set(
+        "search:recipes_total", Recipe.objects.count, RECIPES_TOTAL_TIMEOUT
+    )
+    idf = Case(
+        *(
+            When(
+                term=term,
+                then=Value(math.log(1 + recipes_total / frequency)),
+            )
+            for term, frequency in document_frequency.items()
+        ),
+        output_field=FloatField(),
+    )
+    matches = RecipeSearchTerm.objects.filter(term__in=document_frequency)
+    rank = matches.filter(
+        recipe=OuterRef("pk")
+    ).values("recipe").annotate(
+        rank=Sum(F("weight") * idf, output_field=FloatField())
+    ).values("rank")
+    return queryset.filter(
+        pk__in=matches.values("recipe")
+    ).annotate(
+        search_rank=Subquery(rank, output_field=FloatField())
+    ).order_by("-search_rank", "-pub_date")
@@ -0,0 +1,205 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Subscribe, User
+from .images import schedule_image_variants, variants_are_stale
+from .search import schedule_index
+from .models import (
+    Favourite,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredients,
+    ShoppingCartIngredient,
+    ShoppingCartList,
+    Tag,
+)
+
+# Модель-источник: (модель со счетчиком, поле-ссылка, поле-счетчик).
+COUNTERS = {
+    Recipe: (User, "author_id", "recipes_count"),
+    Subscribe: (User, "author_id", "followers_count"),
+    Favourite: (Recipe, "recipe_id", "favorites_count"),
+}
+
+
+def change_counter(sender, owner_id, delta):
+    model, _, field = COUNTERS[sender]
+    if owner_id is not None:
+        model.objects.filter(pk=owner_id).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
+
+
+@receiver(post_save, sender=ShoppingCartList)
+def add_to_shopping_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        ShoppingCartIngredient.objects.add_recipe(
+            (instance.user_id,), instance.recipe_id
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCartList)
+def remove_from_shopping_cart_totals(sender, instance, **kwargs):
+    # pre_delete: состав рецепта еще не удален каскадом.
+    ShoppingCartIngredient.objects.remove_recipe(
+        (instance.user_id,), instance.recipe_id
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Subscribe)
+@receiver(pre_save, sender=Favourite)
+def remember_counter_owner(sender, instance, **kwargs):
+    """Запоминает прежнего владельца счетчика, если его меняют."""
+    _, attname, _ = COUNTERS[sender]
+    instance._counter_owner_id = None
+    if not instance._state.adding:
+        instance._counter_owner_id = sender.objects.filter(
+            pk=instance.pk
+        ).values_list(attname, flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscribe)
+@receiver(post_save, sender=Favourite)
+def increment_counter(sender, instance, created, **kwargs):
+    _, attname, _ = COUNTERS[sender]
+    owner_id = getattr(instance, attname)
+    if created:
+        change_counter(sender, owner_id, 1)
+    elif instance._counter_owner_id != owner_id:
+        change_counter(sender, instance._counter_owner_id, -1)
+        change_counter(sender, owner_id, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscribe)
+@receiver(post_delete, sender=Favourite)
+def decrement_counter(sender, instance, **kwargs):
+    _, attname, _ = COUNTERS[sender]
+    change_counter(sender, getattr(instance, attname), -1)
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(sender, instance, **kwargs):
+    if variants_are_stale(instance):
+        recipe_id = instance.id
+        transaction.on_commit(lambda: schedule_image_variants(recipe_id))
+
+
+def touch_recipes(recipes, **fields):
+    """Обновляет updated_at, чтобы сбросить кэш данных рецептов."""
+    recipes.update(updated_at=timezone.now(), **fields)
+
+
+@receiver(post_save, sender=RecipeIngredients)
+@receiver(post_delete, sender=RecipeIngredients)
+def touch_recipe_of_ingredient(sender, instance, **kwargs):
+    touch_recipes(
+        Recipe.objects.filter(pk=instance.recipe_id), neighbours_stale=True
+    )
+    schedule_index(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_of_tags(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    if reverse and action == "pre_clear":
+        # После очистки связей со стороны тэга не узнать его рецепты.
+        instance._cleared_recipe_ids = set(
+            instance.recipes.values_list("pk", flat=True)
+        )
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    else:
+        if action == "post_clear":
+            pk_set = instance._cleared_recipe_ids
+        if not pk_set:
+            return
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    recipes.refresh_tag_masks()
+    touch_recipes(recipes)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_recipes_of_tag(sender, instance, **kwargs):
+    # Связи с рецептами удаляются каскадом без m2m_changed.
+    instance._deleted_recipe_ids = set(
+        instance.recipes.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def clear_deleted_tag_bit(sender, instance, **kwargs):
+    recipes = Recipe.objects.filter(pk__in=instance._deleted_recipe_ids)
+    recipes.refresh_tag_masks()
+    touch_recipes(recipes)
+
+
+@receiver(post_save, sender=Tag)
+def touch_recipes_of_tag(sender, instance, **kwargs):
+    touch_recipes(Recipe.objects.filter(tags=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_recipes_of_ingredient(sender, instance, created, **kwargs):
+    if not created:
+        recipes = Recipe.objects.filter(ingredients=instance)
+        touch_recipes(recipes)
+        for recipe_id in recipes.values_list("id", flat=True):
+            schedule_index(recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe_for_search(sender, instance, **kwargs):
+    schedule_index(instance.id)
+
+
+@receiver(post_save, sender=User)
+def touch_recipes_of_author(sender, instance, created, update_fields,
+                            **kwargs):
+    if created or (update_fields and set(update_fields) <= {"last_login"}):
+        return
+    touch_recipes(Recipe.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.add_recipe(instance)
+    elif instance._counter_owner_id != instance.author_id:
+        FeedEntry.objects.filter(recipe=instance).delete()
+        FeedEntry.objects.add_recipe(instance)
+
+
+@receiver(post_save, sender=Subscribe)
+def backfill_feed(sender, instance, created, **kwargs):
+    if not created and instance._counter_owner_id != instance.author_id:
+        FeedEntry.objects.unsubscribe(
+            instance.user_id, instance._counter_owner_id
+        )
+    if created or instance._counter_owner_id != instance.author_id:
+        FeedEntry.objects.subscribe(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscribe)
+def clean_feed(sender, instance, **kwargs):
+    FeedEntry.objects.unsubscribe(instance.user_id, instance.author_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def mark_neighbours_of_deleted_recipe(sender, instance, **kwargs):
+    # Рецепты, у которых удаляемый был в похожих, дополнят список
+    # при следующем пересчете.
+    Recipe.objects.filter(neighbours__similar=instance).update(
+        neighbours_stale=True
+    )
@@ -0,0 +1,185 @@
+"""Похожие рецепты по составу ингредиентов.
+
+Рецепт - разреженный вектор ингредиентов, сходство - коэффициент
+Жаккара |A ∩ B| / |A ∪ B|. Пересечения считаются по инвертированному
+списку ингредиент -> рецепты (строка разреженного произведения X·Xᵀ),
+так что рецепты без общих ингредиентов не сравниваются вовсе.
+Лучшие соседи сохраняются в RecipeNeighbour, и запрос похожих
+рецептов - это чтение по индексу без расчетов.
+"""
+import heapq
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from . import constants
+
+BATCH_SIZE = 500
+
+
+def load_vectors():
+    """{recipe_id: множество ingredient_id} для всех рецептов."""
+    from .models import Recipe, RecipeIngredients
+
+    vectors = {
+        recipe_id: set()
+        for recipe_id in Recipe.objects.values_list(
+            "id", flat=True
+        ).iterator()
+    }
+    for recipe_id, ingredient_id in RecipeIngredients.objects.values_list(
+        "recipe_id", "ingredient_id"
+    ).iterator():
+        if recipe_id in vectors:
+            vectors[recipe_id].add(ingredient_id)
+    return vectors
+
+
+def build_postings(vectors):
+    postings = defaultdict(list)
+    for recipe_id, ingredients in vectors.items():
+        for ingredient_id in ingredients:
+            postings[ingredient_id].append(recipe_id)
+    return postings
+
+
+def neighbour_rank(item):
+    """Порядок соседей: по убыванию сходства, затем по возрастанию id."""
+    similar_id, score = item
+    return score, -similar_id
+
+
+def similarity_scores(recipe_id, vectors, postings):
+    """{similar_id: сходство} для рецептов с общими ингредиентами."""
+    ingredients = vectors[recipe_id]
+    overlaps = Counter()
+    for ingredient_id in ingredients:
+        overlaps.update(postings[ingredient_id])
+    del overlaps[recipe_id]
+    return {
+        similar_id: overlap / (
+            len(ingredients) + len(vectors[similar_id]) - overlap
+        )
+        for similar_id, overlap in overlaps.items()
+    }
+
+
+def top_neighbours(recipe_id, vectors, postings, count):
+    """count самых похожих рецептов: [(similar_id, score)]."""
+    return heapq.nlargest(
+        count,
+        similarity_scores(recipe_id, vectors, postings).items(),
+        key=neighbour_rank,
+    )
+
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def recompute(recipe_ids, vectors, postings, count):
+    """Заново считает соседей recipe_ids."""
+    from .models import RecipeNeighbour
+
+    for batch in chunks(sorted(recipe_ids)):
+        with transaction.atomic():
+            RecipeNeighbour.objects.filter(recipe_id__in=batch).delete()
+            RecipeNeighbour.objects.bulk_create(
+                RecipeNeighbour(
+                    recipe_id=recipe_id, similar_id=similar_id, score=score
+                )
+                for recipe_id in batch
+                for similar_id, score in top_neighbours(
+                    recipe_id, vectors, postings, count
+                )
+            )
+
+
+def merge_offers(offers, count):
+    """Вливает новые сходства {recipe_id: [(similar_id, score)]}
+    в сохраненных соседей: кандидат попадает в список, только если
+    он лучше последнего из count."""
+    from .models import RecipeNeighbour
+
+    for batch in chunks(sorted(offers)):
+        stored = defaultdict(list)
+        for pk, recipe_id, similar_id, score in (
+            RecipeNeighbour.objects.filter(recipe_id__in=batch).values_list(
+                "pk", "recipe_id", "similar_id", "score"
+            )
+        ):
+            stored[recipe_id].append((pk, similar_id, score))
+        removed = []
+        created = []
+        for recipe_id in batch:
+            best = heapq.nlargest(
+                count,
+                [
+                    (similar_id, score)
+                    for _, similar_id, score in stored[recipe_id]
+                ] + offers[recipe_id],
+                key=neighbour_rank,
+            )
+            kept = {similar_id for similar_id, _ in best}
+            removed.extend(
+                pk for pk, similar_id, _ in stored[recipe_id]
+                if similar_id not in kept
+            )
+            created.extend(
+                RecipeNeighbour(
+                    recipe_id=recipe_id, similar_id=similar_id, score=score
+                )
+                for similar_id, score in offers[recipe_id]
+                if similar_id in kept
+            )
+        with transaction.atomic():
+            RecipeNeighbour.objects.filter(pk__in=removed).delete()
+            RecipeNeighbour.objects.bulk_create(created)
+
+
+def refresh_neighbours(full=False, count=constants.SIMILAR_RECIPES_COUNT):
+    """Пересчитывает похожие рецепты, возвращает число рецептов,
+    у которых обновлялся список.
+
+    Без full заново считаются только рецепты с neighbours_stale и рецепты,
+    у которых они были в похожих (их сходство могло упасть). Остальным
+    рецептам с общими ингредиентами новое сходство измененного рецепта
+    вливается в сохраненный список: оно может только вытеснить худшего
+    соседа, так что их полный пересчет не нужен.
+    """
+    from .models import Recipe, RecipeNeighbour
+
+    stale = set(
+        Recipe.objects.filter(neighbours_stale=True).values_list(
+            "id", flat=True
+        )
+    )
+    # Флаг снимается до чтения составов: изменения во время расчета
+    # снова его поставят и попадут в следующий запуск.
+    for batch in chunks(stale):
+        Recipe.objects.filter(pk__in=batch).update(neighbours_stale=False)
+    vectors = load_vectors()
+    postings = build_postings(vectors)
+    if full:
+        recompute(vectors, vectors, postings, count)
+        return len(vectors)
+    affected = set(stale)
+    for batch in chunks(stale):
+        affected.update(
+            RecipeNeighbour.objects.filter(
+                similar_id__in=batch
+            ).values_list("recipe_id", flat=True)
+        )
+    affected &= vectors.keys()
+    recompute(affected, vectors, postings, count)
+    offers = defaultdict(list)
+    for recipe_id in stale & vectors.keys():
+        for similar_id, score in similarity_scores(
+            recipe_id, vectors, postings
+        ).items():
+            if similar_id not in affected:
+                offers[similar_id].append((recipe_id, score))
+    merge_offers(offers, count)
+    return len(affected) + len(offers)
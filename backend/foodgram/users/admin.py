@@ -22,14 +22,6 @@ class UserAdmin(BaseUserAdmin):
     search_fields = ("username",)
     empty_value_display = "-пусто-"
 
-    @admin.display(description='Количество рецептов')
-    def recipes_count(self, obj):
-        return obj.recipes.count()
-
-    @admin.display(description='Количество подписчиков')
-    def followers_count(self, obj):
-        return obj.author.count()
-
 
 @admin.register(Subscribe)
 class SubscribeAdmin(admin.ModelAdmin):
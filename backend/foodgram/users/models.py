@@ -3,10 +3,11 @@ from django.db import models
 from django.db.models import CheckConstraint, UniqueConstraint
 
 from recipes import constants
+from recipes.counters import CounterFieldsMixin
 from .validators import validate_regex_username, validate_username
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     """Модель пользователя."""
 
     first_name = models.CharField(
@@ -28,6 +29,13 @@ class User(AbstractUser):
         max_length=constants.EMAIL_MAX_LENGHT,
         unique=True,
     )
+    recipes_count = models.PositiveIntegerField(
+        "Количество рецептов", default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        "Количество подписчиков", default=0, editable=False
+    )
+    counter_fields = ("recipes_count", "followers_count")
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ("first_name", "last_name", "username")
 